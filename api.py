@@ -0,0 +1,287 @@
+import io
+import json
+import os
+
+import cv2
+
+from color_matching import DITHERING_MODES
+from parallel import prepareDesigns
+from utils import canvas, getDesignGrid, getDesignKey, sampleDesign
+
+def loadConfig(path):
+    """
+    Load a configuration file.
+            
+    Parameters
+    ----------
+    path: str
+        Path to the configuration file
+
+    Returns
+    ----------
+    dict
+        Configuration data
+    """
+    with open(path, 'r') as myfile:
+        # load data
+        data = myfile.read()
+        return json.loads(data)
+
+def resolvePath(path, base_dir):
+    """
+    Resolve the path of a design image. Paths are relative to the working directory as in conf.json; 
+    if the file doesn't exist there, it is looked up relative to the job file.
+    """
+    if os.path.isabs(path) or os.path.exists(path):
+        return path
+    return os.path.join(base_dir, path)
+
+def createCanvas(canvas_data, headless=True, base_dir='.'):
+    """
+    Create a canvas from the "canvas_config" part of a configuration.
+            
+    Parameters
+    ----------
+    canvas_data: dict
+        Configuration of the canvas
+    headless: bool
+        If True, the canvas never opens any window
+    base_dir: str
+        Directory used to resolve the path of the inventory if it is not relative to the working directory
+
+    Returns
+    ----------
+    canvas
+        Empty canvas
+    """
+    # Optional stock of pieces, with the same format as valid_pieces but with the number of pieces available
+    inventory = None
+    if canvas_data.get('inventory') is not None:
+        inventory = loadConfig(resolvePath(canvas_data['inventory'], base_dir))
+    return canvas((canvas_data['blocks_per_row'], canvas_data['blocks_per_col']), canvas_data["valid_pieces"], headless=headless, 
+                  lut_bits=canvas_data.get('lut_bits', 6), color_metric=canvas_data.get('color_metric', 'rgb'),
+                  fill_mode=canvas_data.get('fill_mode', 'greedy'),
+                  merge_design_blocks=canvas_data.get('merge_design_blocks', True), inventory=inventory,
+                  output_formats=canvas_data.get('output_formats', ['png']), plate_size=canvas_data.get('plate_size', 32))
+
+def quantizeDesigns(mosaic, designs_data, base_dir='.', workers=1):
+    """
+    Quantize the designs of a configuration without any GUI. The results are cached by the content of the
+    image and the options of the design, so only new or modified designs are parsed again. The designs 
+    that aren't cached are parsed in parallel when there are several workers.
+            
+    Parameters
+    ----------
+    mosaic: canvas
+        Canvas the designs are quantized for
+    designs_data: dict
+        Configuration of the designs
+    base_dir: str
+        Directory used to resolve design paths that are not relative to the working directory
+    workers: int
+        Number of processes
+
+    Returns
+    ----------
+    dict
+        (key, color_idx, used) for each design, see canvas.quantizeDesign()
+    """
+    palette_key = mosaic.getPaletteKey()
+    quantized = {}
+    missing = []
+    for element in designs_data:
+        path = resolvePath(designs_data[element]['path'], base_dir)
+        if not os.path.exists(path):
+            raise IOError('Couldn\'t read design image: ' + path)
+        key = getDesignKey(path, designs_data[element], palette_key)
+        cached = mosaic.loadCachedDesign(key)
+        if cached is None:
+            missing.append((element, key, path))
+        else:
+            quantized[element] = (key,) + cached
+
+    if workers > 1 and len(missing) > 1:
+        designs = [(designs_data[element], path) for element, key, path in missing]
+        results = prepareDesigns(mosaic, designs, workers)
+    else:
+        results = []
+        for element, key, path in missing:
+            image = cv2.imread(path)
+            if image is None:
+                raise IOError('Couldn\'t read design image: ' + path)
+            design_data = designs_data[element]
+            roi, size = getDesignGrid(image, design_data)
+            design = mosaic.parseDesign(roi, size, design_data.get('sampling', 'center'))
+            results.append(mosaic.quantizeDesign(design, design_data['keep white'], design_data.get('dithering', 'none')))
+    for (element, key, path), (color_idx, used) in zip(missing, results):
+        mosaic.cacheDesign(key, color_idx, used)
+        quantized[element] = (key, color_idx, used)
+    return quantized
+
+def updateDesigns(mosaic, designs_data, quantized, previous=None):
+    """
+    Add the quantized designs to the canvas and fill it. If the canvas was loaded from a previous run, only 
+    the designs that changed (different image, options or position), were added or were removed are updated: 
+    the pieces in their regions are removed, the designs overlapping those regions are added again and only 
+    the released anchors are filled.
+            
+    Parameters
+    ----------
+    mosaic: canvas
+        Canvas where the designs are added
+    designs_data: dict
+        Configuration of the designs
+    quantized: dict
+        (key, color_idx, used) for each design, see quantizeDesigns()
+    previous: dict
+        Records of the designs of the previous run, as returned by updateDesigns(). None to add all the designs.
+
+    Returns
+    ----------
+    dict
+        Records of the designs: cache key, position and size
+    """
+    records = {element: {'key': quantized[element][0], 'position': list(designs_data[element]['position']), 
+                         'size': list(quantized[element][2].shape)} for element in designs_data}
+    if previous is None:
+        for element in designs_data:
+            mosaic.addQuantizedDesign(tuple(designs_data[element]['position']), *quantized[element][1:])
+        mosaic.fill()
+        return records
+
+    def getRegion(record):
+        return tuple(record['position']), tuple(record['size'])
+
+    def overlaps(a, b):
+        return all(a[0][i] < b[0][i] + b[1][i] and b[0][i] < a[0][i] + a[1][i] for i in range(2))
+
+    # Regions of the designs that changed, before and after the change
+    pending = [getRegion(previous[e]) for e in previous if previous[e] != records.get(e)]
+    changed = set(e for e in records if previous.get(e) != records[e])
+    pending += [getRegion(records[e]) for e in changed]
+    # Clearing a region removes the pieces of the designs below it, which have to be added again as well
+    released = []
+    while pending:
+        region = mosaic.clearRegion(*pending.pop())
+        if region is None:
+            continue
+        released.append(region)
+        for element in records:
+            if element not in changed and overlaps(region, getRegion(records[element])):
+                changed.add(element)
+                pending.append(getRegion(records[element]))
+
+    for element in designs_data:
+        if element in changed:
+            mosaic.addQuantizedDesign(tuple(designs_data[element]['position']), *quantized[element][1:])
+    for pos, size in released:
+        mosaic.fillSection(pos, size)
+    print('INFO: Updated ' + str(len(changed)) + ' designs and ' + str(len(released)) + ' regions of the previous canvas')
+    return records
+
+def isIntegerList(value, length):
+    return (isinstance(value, (list, tuple)) and len(value) == length 
+            and all(isinstance(v, int) and not isinstance(v, bool) for v in value))
+
+def validateDesign(design_data, image, canvas_size):
+    """
+    Check the options of a design given to MosaicGenerator.generate(), so invalid designs are reported with
+    a ValueError instead of failing (or wrapping around the canvas) while the design is added.
+
+    Parameters
+    ----------
+    design_data: dict
+        Configuration of the design
+    image: numpy.ndarray
+        BGR image with the design
+    canvas_size: tuple
+        Number of anchors per row and column of the canvas
+    """
+    pos = design_data.get('position')
+    if not isIntegerList(pos, 2) or not (0 <= pos[0] < canvas_size[0] and 0 <= pos[1] < canvas_size[1]):
+        raise ValueError('Invalid position ' + str(pos) + ', it has to be [x, y] inside the canvas of ' 
+                         + str(canvas_size[0]) + 'x' + str(canvas_size[1]) + ' blocks')
+    size = design_data.get('size')
+    if size is not None:
+        if not isIntegerList(size, 2) or min(size) <= 0:
+            raise ValueError('Invalid size ' + str(size) + ', it has to be [blocks per row, blocks per column]')
+        if pos[0] + size[0] > canvas_size[0] or pos[1] + size[1] > canvas_size[1]:
+            raise ValueError('The design of ' + str(size[0]) + 'x' + str(size[1]) + ' blocks at ' + str(pos) 
+                             + ' doesn\'t fit in the canvas of ' + str(canvas_size[0]) + 'x' + str(canvas_size[1]) + ' blocks')
+    crop = design_data.get('crop')
+    if crop is not None:
+        height, width = image.shape[:2]
+        if not isIntegerList(crop, 4) or not (0 <= crop[0] < crop[2] <= width and 0 <= crop[1] < crop[3] <= height):
+            raise ValueError('Invalid crop ' + str(crop) + ', it has to be [x_min, y_min, x_max, y_max] inside the image')
+    if design_data.get('dithering', 'none') not in DITHERING_MODES:
+        raise ValueError('Unknown dithering: ' + str(design_data.get('dithering')) + '. Valid values: ' + ', '.join(DITHERING_MODES))
+
+class MosaicGenerator(object):
+    """
+    Generate mosaics for a canvas configuration. The canvas, its palettes and the lookup table used to 
+    quantize the designs are prepared once, and every mosaic starts from an empty copy of that canvas, so
+    generating a mosaic doesn't rebuild anything. Each mosaic uses its own canvas, so several mosaics can be 
+    generated at the same time from different threads.
+    """
+    def __init__(self, canvas_data, base_dir='.'):
+        self.canvas_data = canvas_data
+        self.template = createCanvas(canvas_data, headless=True, base_dir=base_dir)
+        # Load the lookup table now, so the first mosaic doesn't pay for it
+        self.template.getLookupTable('1x1')
+
+    def quantizeDesign(self, image, design_data):
+        """
+        Quantize a design image.
+            
+        Parameters
+        ----------
+        image: numpy.ndarray
+            BGR image with the design
+        design_data: dict
+            Configuration of the design, with the same format as the designs of conf.json (the path is not used)
+
+        Returns
+        ----------
+        color_idx: numpy.ndarray
+            Index in colors_dictionary of the color of each block
+        used: numpy.ndarray
+            Boolean matrix, True for the blocks that are part of the design
+        """
+        roi, size = getDesignGrid(image, design_data)
+        design = sampleDesign(roi, size, design_data.get('sampling', 'center'))
+        return self.template.quantizeDesign(design, design_data.get('keep white', False), design_data.get('dithering', 'none'))
+
+    def generate(self, designs):
+        """
+        Generate a mosaic.
+            
+        Parameters
+        ----------
+        designs: list
+            List of (design configuration, BGR image) tuples, the designs are added in this order
+
+        Returns
+        ----------
+        canvas
+            Filled canvas
+        """
+        mosaic = self.template.emptyCopy()
+        for design_data, image in designs:
+            validateDesign(design_data, image, mosaic.size)
+            color_idx, used = self.quantizeDesign(image, design_data)
+            pos = tuple(design_data['position'])
+            if pos[0] + used.shape[0] > mosaic.size[0] or pos[1] + used.shape[1] > mosaic.size[1]:
+                raise ValueError('The design of ' + str(used.shape[0]) + 'x' + str(used.shape[1]) + ' blocks at ' 
+                                 + str(list(pos)) + ' doesn\'t fit in the canvas of ' + str(mosaic.size[0]) + 'x' 
+                                 + str(mosaic.size[1]) + ' blocks')
+            mosaic.addQuantizedDesign(pos, color_idx, used)
+        mosaic.fill()
+        return mosaic
+
+def encodePng(mosaic):
+    """
+    Get the PNG file of a canvas as bytes.
+    """
+    buffer = io.BytesIO()
+    mosaic.writePng(buffer)
+    return buffer.getvalue()
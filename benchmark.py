@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from api import createCanvas, loadConfig, resolvePath
+from utils import getDesignGrid
+
+# Number of blocks per row and column of the synthetic designs
+SYNTHETIC_SIZES = [16, 64, 256, 1024]
+# Free blocks around the design in the canvas
+CANVAS_MARGIN = 4
+
+def generateSyntheticDesign(size, seed=0):
+    """
+    Generate a pixel art like image: a few colors arranged in patches, with a white background and
+    each block drawn with several pixels.
+
+    Parameters
+    ----------
+    size: int
+        Number of blocks per row and column
+    seed: int
+        Seed of the random generator, so the designs are the same between runs
+
+    Returns
+    ----------
+    image: numpy.ndarray
+        BGR image with the design
+    """
+    rng = np.random.RandomState(seed)
+    colors = rng.randint(0, 256, size=(12, 3)).astype(np.uint8)
+    colors[0] = [255, 255, 255]
+    # Low resolution noise upscaled to the design size gives patches of the same color
+    coarse = rng.randint(0, len(colors), size=(max(size//4, 1), max(size//4, 1))).astype(np.uint8)
+    blocks = cv2.resize(coarse, (size, size), interpolation=cv2.INTER_NEAREST)
+    pixels_per_block = max(1, min(8, 4096//size))
+    image = colors[blocks]
+    return cv2.resize(image, (size*pixels_per_block, size*pixels_per_block), interpolation=cv2.INTER_NEAREST)
+
+def getCases(config, sizes, base_dir='.'):
+    """
+    Get the benchmark cases: the synthetic designs and the sample designs of the configuration. The paths of 
+    the designs are resolved relative to base_dir (the directory of the configuration file) if they don't 
+    exist relative to the working directory.
+
+    Returns
+    ----------
+    cases: list
+        List of (name, roi, size, keep_white) tuples
+    """
+    cases = []
+    for size in sizes:
+        cases.append(('synthetic_' + str(size), generateSyntheticDesign(size), (size, size), False))
+    for name, design in config.get('designs', {}).items():
+        path = resolvePath(design['path'], base_dir)
+        image = cv2.imread(path)
+        if image is None:
+            raise IOError('Couldn\'t read design image of ' + name + ': ' + path)
+        roi, size = getDesignGrid(image, design)
+        cases.append((name, roi, size, design['keep white']))
+    return cases
+
+def measure(stage, function, *args, trace=False):
+    """
+    Run a stage of the pipeline measuring either its time or its peak memory. Tracing the allocations slows 
+    down the code a lot (more than 10x for some stages), so both are never measured in the same run.
+
+    Parameters
+    ----------
+    trace: bool
+        If True, the peak memory allocated during the stage is measured with tracemalloc, otherwise the time
+
+    Returns
+    ----------
+    result:
+        Value returned by the function
+    record: dict
+        Time in seconds or peak memory in MB allocated during the stage
+    """
+    if trace:
+        tracemalloc.start()
+        result = function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result, {'stage': stage, 'peak_mb': peak / 1e6}
+    start = time.perf_counter()
+    result = function(*args)
+    return result, {'stage': stage, 'seconds': time.perf_counter() - start}
+
+def runCase(canvas_data, roi, size, keep_white, output_dir, trace=False):
+    """
+    Run the whole pipeline for a design placed on a canvas slightly bigger than it, timing each stage or, with 
+    trace, measuring the peak memory of each stage (see measure()).
+
+    Returns
+    ----------
+    records: list
+        One record per stage
+    """
+    canvas_size = (size[0] + 2*CANVAS_MARGIN, size[1] + 2*CANVAS_MARGIN)
+    records = []
+    canvas_data = dict(canvas_data, blocks_per_row=canvas_size[0], blocks_per_col=canvas_size[1], inventory=None)
+    mosaic, record = measure('canvas', createCanvas, canvas_data, trace=trace)
+    records.append(record)
+    design, record = measure('parseDesign', mosaic.parseDesign, roi.copy(), size, trace=trace)
+    records.append(record)
+    # The lookup table is built (or loaded from the cache) the first time it is used, it is timed on its own so
+    # it doesn't distort the color matching
+    _, record = measure('getLookupTable', mosaic.getLookupTable, '1x1', trace=trace)
+    records.append(record)
+    _, record = measure('getClosestColor', mosaic.getClosestColors, '1x1', design[:, :, ::-1], trace=trace)
+    records.append(record)
+    _, record = measure('addDesign', mosaic.addDesign, (CANVAS_MARGIN, CANVAS_MARGIN), design, keep_white, trace=trace)
+    records.append(record)
+    _, record = measure('fill', mosaic.fill, trace=trace)
+    records.append(record)
+    _, record = measure('save', mosaic.save, output_dir, trace=trace)
+    records.append(record)
+    return records
+
+def getCommit():
+    """
+    Get the current git commit, so results of different versions can be told apart.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runBenchmark(config, sizes, repeat=3, base_dir='.'):
+    """
+    Run all the benchmark cases. Each case is repeated and the fastest run of each stage is kept, then it is 
+    run once more to measure the peak memory of each stage.
+
+    Returns
+    ----------
+    dict
+        Results with the commit, the environment and one record per case and stage
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, roi, size, keep_white in getCases(config, sizes, base_dir):
+            runs = [runCase(config['canvas_config'], roi, size, keep_white, output_dir) for _ in range(repeat)]
+            memory = runCase(config['canvas_config'], roi, size, keep_white, output_dir, trace=True)
+            for stage_runs, stage_memory in zip(zip(*runs), memory):
+                best = min(stage_runs, key=lambda r: r['seconds'])
+                record = {'case': name, 'design_size': list(size)}
+                record.update(best)
+                record['peak_mb'] = stage_memory['peak_mb']
+                results.append(record)
+                print('INFO: {:<16} {:<16} {:9.4f} s {:9.1f} MB'.format(name, record['stage'], record['seconds'], record['peak_mb']))
+    return {'commit': getCommit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'opencv': cv2.__version__, 'repeat': repeat, 'results': results}
+
+def compareResults(baseline, current):
+    """
+    Print the change of time and memory of each case and stage with respect to a previous run.
+    """
+    previous = {(r['case'], r['stage']): r for r in baseline['results']}
+    print('INFO: Comparison with ' + str(baseline.get('commit')) + ' (ratio current/baseline, < 1 is better)')
+    for record in current['results']:
+        key = (record['case'], record['stage'])
+        if key not in previous:
+            continue
+        old = previous[key]
+        time_ratio = record['seconds'] / max(old['seconds'], 1e-9)
+        memory_ratio = record['peak_mb'] / max(old['peak_mb'], 1e-9)
+        print('INFO: {:<16} {:<16} time x{:6.2f}  memory x{:6.2f}'.format(key[0], key[1], time_ratio, memory_ratio))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the canvas pipeline')
+    parser.add_argument('--config', default='./conf.json', help='configuration file with the canvas and the sample designs')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SYNTHETIC_SIZES, help='sizes of the synthetic designs')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs of each case')
+    parser.add_argument('--output', default='./benchmark_results.json', help='file where the results are saved')
+    parser.add_argument('--compare', help='results of a previous run to compare with')
+    args = parser.parse_args()
+
+    results = runBenchmark(loadConfig(args.config), args.sizes, args.repeat, os.path.dirname(os.path.abspath(args.config)))
+    with open(args.output, 'w') as outfile:
+        json.dump(results, outfile, indent=4)
+    print('INFO: Results saved at: ' + args.output)
+    if args.compare is not None:
+        compareResults(loadConfig(args.compare), results)
@@ -0,0 +1,418 @@
+import hashlib
+import os
+
+import numpy as np
+
+# Color difference metrics that can be used to match the design colors with the Lego colors:
+#   rgb: euclidean distance in RGB
+#   lab: euclidean distance in CIELAB (Delta E 1976)
+#   ciede2000: CIEDE2000 color difference (Delta E 2000)
+COLOR_METRICS = ('rgb', 'lab', 'ciede2000')
+
+# Dithering modes used to quantize photos, where the nearest color gives banding:
+#   none: nearest color of each block
+#   floyd-steinberg: error diffusion, the error of each block is spread to the neighbours not yet quantized
+#   bayer: ordered dithering, a fixed threshold pattern is added before matching
+DITHERING_MODES = ('none', 'floyd-steinberg', 'bayer')
+
+def rgbToLab(rgb):
+    """
+    Convert sRGB values to CIELAB (D65 white point).
+
+    Parameters
+    ----------
+    rgb: numpy.ndarray
+        Array of RGB values in the range [0, 255] with shape (..., 3)
+
+    Returns
+    ----------
+    numpy.ndarray
+        Array of L*a*b* values with shape (..., 3)
+    """
+    c = np.asarray(rgb, dtype=np.float64) / 255
+    # Undo the sRGB gamma
+    c = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055)**2.4)
+    # Linear RGB to XYZ, normalized by the D65 white point
+    m = np.asarray([[0.4124564, 0.3575761, 0.1804375],
+                    [0.2126729, 0.7151522, 0.0721750],
+                    [0.0193339, 0.1191920, 0.9503041]])
+    xyz = (c @ m.T) / np.asarray([0.95047, 1.0, 1.08883])
+    # XYZ to Lab
+    delta = 6 / 29
+    f = np.where(xyz > delta**3, np.cbrt(xyz), xyz / (3 * delta**2) + 4 / 29)
+    L = 116 * f[..., 1] - 16
+    a = 500 * (f[..., 0] - f[..., 1])
+    b = 200 * (f[..., 1] - f[..., 2])
+    return np.stack((L, a, b), axis=-1)
+
+def ciede2000(lab1, lab2):
+    """
+    CIEDE2000 color difference between two arrays of L*a*b* values. Both arrays are broadcasted 
+    against each other, e.g. (N, 1, 3) and (1, K, 3) give the (N, K) matrix of differences.
+
+    Parameters
+    ----------
+    lab1: numpy.ndarray
+        Array of L*a*b* values with shape (..., 3)
+    lab2: numpy.ndarray
+        Array of L*a*b* values with shape (..., 3)
+
+    Returns
+    ----------
+    numpy.ndarray
+        Color differences
+    """
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    # Adjust the a* axis depending on the chroma
+    C_mean = (np.hypot(a1, b1) + np.hypot(a2, b2)) / 2
+    G = 0.5 * (1 - np.sqrt(C_mean**7 / (C_mean**7 + 25.0**7)))
+    a1p = (1 + G) * a1
+    a2p = (1 + G) * a2
+    C1p = np.hypot(a1p, b1)
+    C2p = np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+
+    # Differences in lightness, chroma and hue
+    zero_chroma = (C1p * C2p) == 0
+    dLp = L2 - L1
+    dCp = C2p - C1p
+    dhp = h2p - h1p
+    dhp = np.where(dhp > 180, dhp - 360, np.where(dhp < -180, dhp + 360, dhp))
+    dhp = np.where(zero_chroma, 0, dhp)
+    dHp = 2 * np.sqrt(C1p * C2p) * np.sin(np.radians(dhp) / 2)
+
+    # Mean values
+    Lp_mean = (L1 + L2) / 2
+    Cp_mean = (C1p + C2p) / 2
+    hp_sum = h1p + h2p
+    hp_mean = np.where(np.abs(h1p - h2p) <= 180, hp_sum / 2, np.where(hp_sum < 360, (hp_sum + 360) / 2, (hp_sum - 360) / 2))
+    hp_mean = np.where(zero_chroma, hp_sum, hp_mean)
+
+    # Weighting functions
+    T = (1 - 0.17 * np.cos(np.radians(hp_mean - 30)) + 0.24 * np.cos(np.radians(2 * hp_mean)) 
+         + 0.32 * np.cos(np.radians(3 * hp_mean + 6)) - 0.20 * np.cos(np.radians(4 * hp_mean - 63)))
+    d_theta = 30 * np.exp(-((hp_mean - 275) / 25)**2)
+    Rc = 2 * np.sqrt(Cp_mean**7 / (Cp_mean**7 + 25.0**7))
+    Sl = 1 + 0.015 * (Lp_mean - 50)**2 / np.sqrt(20 + (Lp_mean - 50)**2)
+    Sc = 1 + 0.045 * Cp_mean
+    Sh = 1 + 0.015 * Cp_mean * T
+    Rt = -np.sin(np.radians(2 * d_theta)) * Rc
+
+    return np.sqrt((dLp / Sl)**2 + (dCp / Sc)**2 + (dHp / Sh)**2 + Rt * (dCp / Sc) * (dHp / Sh))
+
+def convertColors(rgb, metric='rgb'):
+    """
+    Convert RGB values to the color space where the metric is computed.
+
+    Parameters
+    ----------
+    rgb: numpy.ndarray
+        Array of RGB values with shape (..., 3)
+    metric: str
+        One of COLOR_METRICS
+
+    Returns
+    ----------
+    numpy.ndarray
+        Array of RGB values for the rgb metric and L*a*b* values otherwise
+    """
+    if metric not in COLOR_METRICS:
+        raise ValueError('Unknown color metric: ' + str(metric) + '. Valid values: ' + ', '.join(COLOR_METRICS))
+    if metric == 'rgb':
+        return np.asarray(rgb, dtype=np.float64)
+    return rgbToLab(rgb)
+
+def getClosestIndices(colors, palette, metric='rgb', chunk_size=65536):
+    """
+    Get the index of the closest palette color for an array of RGB values.
+
+    Parameters
+    ----------
+    colors: numpy.ndarray
+        Array of RGB values with shape (N, 3)
+    palette: numpy.ndarray
+        Palette with shape (K, 3), already converted with convertColors(palette, metric)
+    metric: str
+        One of COLOR_METRICS
+    chunk_size: int
+        Number of colors matched at once, it bounds the size of the (N, K) distance matrix
+
+    Returns
+    ----------
+    numpy.ndarray
+        Index of the closest color in the palette, with shape (N,)
+    """
+    colors = convertColors(colors, metric)
+    palette = np.asarray(palette, dtype=np.float64)
+    if metric != 'ciede2000':
+        # Squared euclidean distance between each color and each color of the palette, (N, K) matrix, expanded 
+        # as |c|^2 - 2 c.p + |p|^2. The |c|^2 term doesn't change the argmin, so it is skipped.
+        distances = np.sum(palette**2, axis=1)[np.newaxis, :] - 2 * colors @ palette.T
+        return np.argmin(distances, axis=1)
+
+    indices = np.zeros(len(colors), dtype=np.int64)
+    for start in range(0, len(colors), chunk_size):
+        chunk = colors[start:start+chunk_size]
+        distances = ciede2000(chunk[:, np.newaxis, :], palette[np.newaxis, :, :])
+        indices[start:start+chunk_size] = np.argmin(distances, axis=1)
+    return indices
+
+def getColorDistances(colors, palette, metric='rgb'):
+    """
+    Get the difference between each pair of colors of two arrays.
+
+    Parameters
+    ----------
+    colors: numpy.ndarray
+        Array of colors with shape (N, 3), already converted with convertColors(colors, metric)
+    palette: numpy.ndarray
+        Array of colors with shape (K, 3), already converted with convertColors(palette, metric)
+    metric: str
+        One of COLOR_METRICS
+
+    Returns
+    ----------
+    numpy.ndarray
+        Matrix of differences with shape (N, K)
+    """
+    colors = np.asarray(colors, dtype=np.float64)[:, np.newaxis, :]
+    palette = np.asarray(palette, dtype=np.float64)[np.newaxis, :, :]
+    if metric == 'ciede2000':
+        return ciede2000(colors, palette)
+    return np.linalg.norm(colors - palette, axis=2)
+
+def paletteHash(palette, palette_idx, bits, metric='rgb'):
+    """
+    Get a hash that identifies a lookup table: it depends on the palette, the values stored in the 
+    table, the quantization and the color metric.
+    """
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(palette, dtype=np.float32).tobytes())
+    h.update(np.ascontiguousarray(palette_idx, dtype=np.int64).tobytes())
+    h.update(str(bits).encode())
+    h.update(metric.encode())
+    return h.hexdigest()[:16]
+
+def buildLookupTable(palette, palette_idx, bits=6, metric='rgb'):
+    """
+    Build a lookup table that maps every RGB value to the closest color of the palette.
+
+    Parameters
+    ----------
+    palette: numpy.ndarray
+        Palette with shape (K, 3), already converted with convertColors(palette, metric)
+    palette_idx: numpy.ndarray
+        Value stored in the table for each color of the palette, e.g. its index in colors_dictionary
+    bits: int
+        Number of bits per channel used to index the table. With less than 8 bits, the RGB values are
+        quantized and each cell of the table is matched using the center of the cell.
+    metric: str
+        One of COLOR_METRICS
+
+    Returns
+    ----------
+    lut: numpy.ndarray
+        Table with shape (2**bits, 2**bits, 2**bits)
+    """
+    n = 2**bits
+    step = 256 / n
+    # RGB value represented by each cell of the table
+    centers = np.arange(n) * step + (step - 1) / 2
+    g, b = np.meshgrid(centers, centers, indexing='ij')
+    gb = np.stack((g.ravel(), b.ravel()), axis=1)
+
+    palette_idx = np.asarray(palette_idx, dtype=np.uint8)
+    lut = np.zeros((n, n, n), dtype=np.uint8)
+    # Build the table one red plane at a time to keep the distance matrix small
+    for r in range(n):
+        colors = np.concatenate((np.full((len(gb), 1), centers[r]), gb), axis=1)
+        lut[r] = palette_idx[getClosestIndices(colors, palette, metric)].reshape(n, n)
+    return lut
+
+def loadLookupTable(palette, palette_idx, bits=6, metric='rgb', cache_dir='./.cache'):
+    """
+    Get the lookup table for a palette. The table is cached on disk and memory-mapped, so it is only
+    built the first time a palette is used.
+
+    Parameters
+    ----------
+    palette: numpy.ndarray
+        Palette with shape (K, 3), already converted with convertColors(palette, metric)
+    palette_idx: numpy.ndarray
+        Value stored in the table for each color of the palette
+    bits: int
+        Number of bits per channel used to index the table
+    metric: str
+        One of COLOR_METRICS
+    cache_dir: str
+        Directory for the cached tables. If None, the table is not cached.
+
+    Returns
+    ----------
+    lut: numpy.ndarray
+        Table with shape (2**bits, 2**bits, 2**bits)
+    """
+    if cache_dir is None:
+        return buildLookupTable(palette, palette_idx, bits, metric)
+
+    path = os.path.join(cache_dir, 'lut_' + paletteHash(palette, palette_idx, bits, metric) + '.npy')
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        lut = buildLookupTable(palette, palette_idx, bits, metric)
+        # Write to a temporary file first, so other processes never see a partially written table
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as outfile:
+            np.save(outfile, lut)
+        os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r')
+
+def applyLookupTable(lut, colors):
+    """
+    Get the value of the lookup table for an array of RGB values.
+
+    Parameters
+    ----------
+    lut: numpy.ndarray
+        Table built by buildLookupTable()
+    colors: numpy.ndarray
+        Array of RGB values with shape (..., 3)
+
+    Returns
+    ----------
+    numpy.ndarray
+        Values of the table with shape (...)
+    """
+    shift = 8 - int(np.log2(lut.shape[0]))
+    colors = np.clip(np.rint(colors), 0, 255).astype(np.uint8) >> shift
+    return lut[colors[..., 0], colors[..., 1], colors[..., 2]]
+
+def assignWithCapacity(demand, capacity, distances):
+    """
+    Distribute groups of blocks among colors with a limited capacity, minimizing the total color error.
+    The problem is solved with Vogel's approximation: at each step, the group that would lose the most by
+    not getting its closest available color (the biggest regret) is served first, so the substitutions
+    are chosen globally instead of first-come-first-served. The number of steps only depends on the
+    number of colors, not on the number of blocks.
+
+    Parameters
+    ----------
+    demand: numpy.ndarray
+        Number of blocks of each group with shape (N,), e.g. the blocks quantized to each color
+    capacity: numpy.ndarray
+        Number of blocks that can be assigned to each color with shape (K,)
+    distances: numpy.ndarray
+        Error of assigning a block of each group to each color with shape (N, K)
+
+    Returns
+    ----------
+    assigned: numpy.ndarray
+        Number of blocks of each group assigned to each color with shape (N, K). The blocks that don't
+        fit in the capacity are left unassigned.
+    """
+    demand = np.asarray(demand, dtype=np.int64).copy()
+    capacity = np.asarray(capacity, dtype=np.int64).copy()
+    distances = np.asarray(distances, dtype=np.float64)
+    assigned = np.zeros(distances.shape, dtype=np.int64)
+    while demand.sum() > 0 and capacity.sum() > 0:
+        # Closest and second closest available color of each group
+        available = np.where(capacity > 0, distances, np.inf)
+        order = np.argsort(available, axis=1)
+        rows = np.arange(len(demand))
+        best = available[rows, order[:, 0]]
+        second = available[rows, order[:, 1]] if available.shape[1] > 1 else np.full(len(demand), np.inf)
+        # The regret is infinite when there is a single color left, those groups go first
+        regret = np.where(demand > 0, np.where(np.isinf(second), np.inf, second - best), -np.inf)
+        candidates = np.nonzero(regret == regret.max())[0]
+        group = candidates[np.argmin(best[candidates])]
+        color = order[group, 0]
+        amount = min(demand[group], capacity[color])
+        assigned[group, color] += amount
+        demand[group] -= amount
+        capacity[color] -= amount
+    return assigned
+
+def getBayerMatrix(n):
+    """
+    Get the Bayer threshold matrix of size 2**n x 2**n, with values in [0, 1).
+    """
+    matrix = np.zeros((1, 1))
+    for _ in range(n):
+        matrix = np.block([[4*matrix, 4*matrix + 2], [4*matrix + 3, 4*matrix + 1]])
+    return matrix / matrix.size
+
+def ditherBayer(colors, lut, color_table, n=2):
+    """
+    Quantize a matrix of colors with ordered dithering. The amplitude of the threshold pattern is the typical
+    distance between the colors of the palette, so smooth gradients are rendered mixing the two closest colors.
+
+    Parameters
+    ----------
+    colors: numpy.ndarray
+        Matrix of RGB values with shape (W, H, 3)
+    lut: numpy.ndarray
+        Lookup table from RGB values to indexes in color_table (see buildLookupTable)
+    color_table: numpy.ndarray
+        RGB values of the colors with shape (C, 3)
+    n: int
+        The threshold matrix has size 2**n x 2**n
+
+    Returns
+    ----------
+    numpy.ndarray
+        Index in color_table of the color of each element, with shape (W, H)
+    """
+    palette = np.asarray(color_table, dtype=np.float64)[np.unique(lut)]
+    distances = getColorDistances(palette, palette)
+    np.fill_diagonal(distances, np.inf)
+    spread = np.median(distances.min(axis=1)) if len(palette) > 1 else 0
+
+    size = 2**n
+    threshold = getBayerMatrix(n) - 0.5
+    tiles = (colors.shape[0] // size + 1, colors.shape[1] // size + 1)
+    offsets = np.tile(threshold, tiles)[:colors.shape[0], :colors.shape[1]]
+    return applyLookupTable(lut, colors + spread * offsets[..., np.newaxis])
+
+def ditherFloydSteinberg(colors, lut, color_table):
+    """
+    Quantize a matrix of colors with Floyd-Steinberg error diffusion, scanning the rows (y) from left to right
+    (x). The error of each element is spread to (x+1, y), (x-1, y+1), (x, y+1) and (x+1, y+1), so the element
+    (x, y) only depends on elements with a lower x + 2y. All the elements on the same wavefront x + 2y = t
+    are independent and they are quantized at once.
+
+    Parameters
+    ----------
+    colors: numpy.ndarray
+        Matrix of RGB values with shape (W, H, 3)
+    lut: numpy.ndarray
+        Lookup table from RGB values to indexes in color_table (see buildLookupTable)
+    color_table: numpy.ndarray
+        RGB values of the colors with shape (C, 3)
+
+    Returns
+    ----------
+    numpy.ndarray
+        Index in color_table of the color of each element, with shape (W, H)
+    """
+    width, height = colors.shape[:2]
+    color_table = np.asarray(color_table, dtype=np.float64)
+    # Working copy with the diffused error, padded so that the neighbours outside the matrix can be written
+    values = np.zeros((width + 2, height + 1, 3))
+    values[1:-1, :-1] = colors
+    indices = np.zeros((width, height), dtype=lut.dtype)
+    for t in range(width + 2*(height - 1)):
+        ys = np.arange(max(0, (t - width + 2) // 2), min(height - 1, t // 2) + 1)
+        xs = t - 2*ys
+        # Padded x coordinates
+        px = xs + 1
+        current = np.clip(values[px, ys], 0, 255)
+        idx = applyLookupTable(lut, current)
+        indices[xs, ys] = idx
+        error = current - color_table[idx]
+        values[px+1, ys] += error * (7/16)
+        values[px-1, ys+1] += error * (3/16)
+        values[px, ys+1] += error * (5/16)
+        values[px+1, ys+1] += error * (1/16)
+    return indices
@@ -1,9 +1,16 @@
-import json
+import argparse
+import glob
+import os
+import sys
 
 import cv2
 import numpy as np
 
-from utils import canvas
+from api import createCanvas, loadConfig, quantizeDesigns, resolvePath, updateDesigns
+from parallel import runJobs
+from profiling import Profiler, isProfilingEnabled
+from sharding import generateShardedMosaic
+from utils import detectDesignGrid
 
 def selectCroppingRefPoints(event, x, y, flags, param):
     # grab references to the global variables
@@ -64,47 +71,220 @@ def cropImage(image):
         elif key == ord("c"):
             break
 
-# Load the configuration file:
-with open('./conf.json', 'r') as myfile:
-    # load data
-    data = myfile.read()
-    loaded_json = json.loads(data)
-
-# Initialize the canvas that we will use for our design
-canvas_data = loaded_json['canvas_config']
-mosaic = canvas((canvas_data['blocks_per_row'], canvas_data['blocks_per_col']), canvas_data["valid_pieces"])
-mosaic.visualizeColorPalette()
-
-
-# Get the data regarding the pixel-art designs that we want to add to the canvas
-designs_data = loaded_json['designs']
-for element in designs_data:
-    # Load the data regarding the current design:
-    size = (designs_data[element]['size'][0], designs_data[element]['size'][1])
-    pos_x = designs_data[element]['position'][0]
-    pos_y = designs_data[element]['position'][1]
-    keep_white_blocks = designs_data[element]['keep white']
-
-    # When the reset button is pressed, cropImage will return None and we load the image again. 
-    # ToDo: originally I wanted to do the reset process inside the cropping function, however, it didn't work. 
-    # The image was reset but then I was unable to draw the reference rectangles. It would be nice to do it inside 
-    # the function and avoid the while loop
-    roi = None
-    while roi is None:
-        image = cv2.imread(designs_data[element]['path'])
-        # get the region of interest
-        roi = cropImage(image)
-        # Reset the containers
-        refPt.clear()
-        cropPt.clear()
-    # Extract the design from the roi
-    design = mosaic.parseDesign(roi, size)
-    # Add design to canvas and visualize the result
-    mosaic.addDesign((pos_x,pos_y), design, keep_white_blocks)
+def generateMosaic(config, output_dir='./', headless=False, base_dir='.', workers=1, incremental=False):
+    """
+    Generate a mosaic given its configuration.
+            
+    Parameters
+    ----------
+    config: dict
+        Configuration data with the same format as conf.json
+    output_dir: str
+        Directory where mosaic.png and summary.json are written
+    headless: bool
+        If True, no windows are opened and the crop boxes are taken from the configuration or detected automatically
+    base_dir: str
+        Directory used to resolve design paths that are not relative to the working directory
+    workers: int
+        Number of processes used to parse the designs in headless mode
+    incremental: bool
+        In headless mode, update the canvas saved in output_dir by the previous run instead of generating it 
+        from scratch: only the regions of the designs that changed are cleared, filled and rendered again
+
+    Returns
+    ----------
+    mosaic: canvas
+        The resulting canvas, None if it was generated in shards (see sharding.generateShardedMosaic)
+    """
+    # Initialize the canvas that we will use for our design
+    canvas_data = config['canvas_config']
+    if canvas_data.get('shard_size') is not None:
+        if not headless:
+            print('WARNING: The canvas is only split in shards in batch mode')
+        else:
+            # Wall-sized mosaics are generated one shard at a time, the whole canvas is never created
+            if incremental:
+                print('WARNING: Incremental updates aren\'t supported for sharded mosaics, generating it from scratch')
+            if isProfilingEnabled(canvas_data):
+                print('WARNING: Profiling isn\'t supported for sharded mosaics, no profile is written')
+            generateShardedMosaic(config, output_dir, base_dir, workers)
+            return None
+    mosaic = createCanvas(canvas_data, headless, base_dir)
+    mosaic.visualizeColorPalette()
+
+    # Optional instrumentation of the canvas, enabled with canvas_config.profile or the LEGO_MOSAIC_PROFILE variable
+    profiler = None
+    if isProfilingEnabled(canvas_data):
+        profiler = Profiler()
+        profiler.instrument(mosaic)
+        profiler.start()
+
+    # Get the data regarding the pixel-art designs that we want to add to the canvas
+    designs_data = config.get('designs', {})
+    if headless:
+        # The designs are quantized once and cached, and the canvas is updated from the state of the previous run
+        quantized = quantizeDesigns(mosaic, designs_data, base_dir, workers)
+        state_path = os.path.join(output_dir, 'state.npz')
+        previous = mosaic.loadState(state_path) if incremental else None
+        records = updateDesigns(mosaic, designs_data, quantized, previous)
+        mosaic.save(output_dir)
+        mosaic.saveState(state_path, records)
+        stopProfiling(profiler, output_dir)
+        return mosaic
+
+    for element in designs_data:
+        # Load the data regarding the current design:
+        pos_x = designs_data[element]['position'][0]
+        pos_y = designs_data[element]['position'][1]
+        keep_white_blocks = designs_data[element]['keep white']
+        path = resolvePath(designs_data[element]['path'], base_dir)
+
+        # When the reset button is pressed, cropImage will return None and we load the image again. 
+        # ToDo: originally I wanted to do the reset process inside the cropping function, however, it didn't work. 
+        # The image was reset but then I was unable to draw the reference rectangles. It would be nice to do it inside 
+        # the function and avoid the while loop
+        roi = None
+        while roi is None:
+            image = cv2.imread(path)
+            # get the region of interest
+            roi = cropImage(image)
+            # Reset the containers
+            refPt.clear()
+            cropPt.clear()
+        # Without a size in the configuration, detect the blocks of the design in the roi
+        if designs_data[element].get('size') is not None:
+            size = tuple(designs_data[element]['size'])
+        else:
+            (x_min, y_min, x_max, y_max), size = detectDesignGrid(roi)
+            roi = roi[y_min:y_max, x_min:x_max]
+            print('INFO: Detected ' + str(size[0]) + 'x' + str(size[1]) + ' blocks in ' + element)
+        # Extract the design from the roi
+        design = mosaic.parseDesign(roi, size, designs_data[element].get('sampling', 'center'))
+        # Add design to canvas and visualize the result
+        mosaic.addDesign((pos_x,pos_y), design, keep_white_blocks, designs_data[element].get('dithering', 'none'))
+        mosaic.visualize()
+
+    mosaic.fill()
     mosaic.visualize()
+    mosaic.save(output_dir)
+    stopProfiling(profiler, output_dir)
+    return mosaic
+
+def stopProfiling(profiler, output_dir):
+    """
+    Stop the profiler of a run, if any, and save its results into output_dir (see profiling.Profiler.save).
+    """
+    if profiler is not None:
+        profiler.stop()
+        profiler.save(output_dir)
+
+def loadJobs(jobs_path):
+    """
+    Load the jobs for the batch mode. The jobs can be given as:
+        - A directory: every *.json file inside with a "canvas_config" is a configuration file with the same
+          format as conf.json, the other files (e.g. an inventory) are skipped.
+        - A configuration file with the same format as conf.json.
+        - A manifest file: {"jobs": [...]} where each job is either the path to a configuration file 
+          or an inline configuration with an optional "name".
+            
+    Parameters
+    ----------
+    jobs_path: str
+        Path to the directory or the manifest
+
+    Returns
+    ----------
+    jobs: list
+        List of (name, config, base_dir) tuples
+    """
+    jobs = []
+    if os.path.isdir(jobs_path):
+        for path in sorted(glob.glob(os.path.join(jobs_path, '*.json'))):
+            config = loadConfig(path)
+            # Other JSON files, like an inventory, can be kept next to the jobs
+            if not isinstance(config, dict) or 'canvas_config' not in config:
+                print('WARNING: Skipping ' + path + ', it isn\'t a job configuration (no "canvas_config")')
+                continue
+            name = os.path.splitext(os.path.basename(path))[0]
+            jobs.append((name, config, os.path.dirname(path)))
+        return jobs
+
+    manifest = loadConfig(jobs_path)
+    base_dir = os.path.dirname(jobs_path)
+    if 'canvas_config' in manifest:
+        name = os.path.splitext(os.path.basename(jobs_path))[0]
+        return [(name, manifest, base_dir)]
+
+    for idx, job in enumerate(manifest['jobs']):
+        if isinstance(job, str):
+            path = resolvePath(job, base_dir)
+            name = os.path.splitext(os.path.basename(path))[0]
+            jobs.append((name, loadConfig(path), os.path.dirname(path)))
+        else:
+            jobs.append((job.get('name', 'job_' + str(idx)), job, base_dir))
+    return jobs
+
+def runJob(name, config, job_dir, base_dir, workers=1, incremental=False):
+    """
+    Generate the mosaic of a batch job without any GUI. The workers are used to parse its designs in parallel.
+            
+    Returns
+    ----------
+    bool
+        True if the job succeeded, False otherwise
+    """
+    os.makedirs(job_dir, exist_ok=True)
+    try:
+        generateMosaic(config, job_dir, headless=True, base_dir=base_dir, workers=workers, incremental=incremental)
+        return True
+    except Exception as e:
+        # A broken job shouldn't stop the rest of the batch
+        print('ERROR: Job ' + name + ' failed: ' + str(e))
+        return False
+
+def runBatch(jobs_path, output_dir, workers=1, incremental=False):
+    """
+    Generate all the mosaics of a directory or manifest of jobs without any GUI. The results of each 
+    job (mosaic.png and summary.json) are saved into output_dir/<job name>/.
+            
+    Parameters
+    ----------
+    jobs_path: str
+        Path to the directory or the manifest with the jobs
+    output_dir: str
+        Directory where the results are saved
+    workers: int
+        Number of processes, the jobs are spread across them
+    incremental: bool
+        Update the results of the previous run instead of generating them from scratch
+
+    Returns
+    ----------
+    int
+        Number of jobs that failed
+    """
+    jobs = [(name, config, os.path.join(output_dir, name), base_dir) for name, config, base_dir in loadJobs(jobs_path)]
+    if workers > 1 and len(jobs) > 1:
+        results = runJobs(runJob, [job + (1, incremental) for job in jobs], workers)
+    else:
+        # A single job uses the workers to parse its designs in parallel
+        results = [runJob(*job, workers=workers, incremental=incremental) for job in jobs]
+    return results.count(False)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Lego mosaic generator')
+    parser.add_argument('--config', default='./conf.json', help='configuration file for the interactive mode')
+    parser.add_argument('--batch', help='directory or manifest with the jobs to generate without GUI')
+    parser.add_argument('--output', default='./output', help='output directory for the batch mode')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes used in batch mode (0: all the cores)')
+    parser.add_argument('--incremental', action='store_true', help='in batch mode, only update the designs that changed since the previous run')
+    args = parser.parse_args()
+
+    if args.batch is not None:
+        workers = args.workers if args.workers > 0 else os.cpu_count()
+        sys.exit(1 if runBatch(args.batch, args.output, workers, args.incremental) > 0 else 0)
 
-mosaic.fill()
-mosaic.visualize()
-mosaic.save()
-# close all open windows
-cv2.destroyAllWindows()
+    # Load the configuration file and generate the mosaic
+    generateMosaic(loadConfig(args.config))
+    # close all open windows
+    cv2.destroyAllWindows()
@@ -0,0 +1,158 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from utils import detectDesignBox, getDesignGrid, quantizeDesign, sampleDesign
+
+class SharedArray(object):
+    """
+    NumPy array stored in shared memory. Only its description (name, shape and dtype) is sent to the
+    worker processes, which attach to the same memory instead of receiving a pickled copy.
+    """
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            # Only the process that created the memory is in charge of releasing it
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def fromArray(cls, array):
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    def describe(self):
+        """
+        Picklable description of the array, see attach().
+        """
+        return (self.shm.name, self.shape, self.dtype.str)
+
+    @classmethod
+    def attach(cls, description):
+        name, shape, dtype = description
+        return cls(shape, dtype, name=name)
+
+    def close(self):
+        del self.array
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def prepareDesignWorker(task):
+    """
+    Parse and quantize a design in a worker process. The image is either read from disk or taken from
+    shared memory, and the result is written to the shared output arrays.
+
+    Parameters
+    ----------
+    task: dict
+        'path' or 'image' (shared array description), 'design' (configuration of the design), 'color_table', 
+        'lut', 'color_idx' and 'used' (shared array descriptions)
+    """
+    shared = [SharedArray.attach(task[k]) for k in ('lut', 'color_idx', 'used')]
+    lut, color_idx, used = [s.array for s in shared]
+    try:
+        if 'image' in task:
+            shared.append(SharedArray.attach(task['image']))
+            image = shared[-1].array
+        else:
+            image = cv2.imread(task['path'])
+            if image is None:
+                raise IOError('Couldn\'t read design image: ' + task['path'])
+        design_data = task['design']
+        roi, size = getDesignGrid(image, design_data)
+        design = sampleDesign(roi, size, design_data.get('sampling', 'center'))
+        color_idx[...], used[...] = quantizeDesign(design, lut, design_data['keep white'], design_data.get('dithering', 'none'), 
+                                                   task['color_table'])
+    finally:
+        for s in shared:
+            s.close()
+
+def prepareDesigns(mosaic, designs, workers=None):
+    """
+    Parse and quantize several designs in parallel using a process pool. The lookup table of the canvas
+    and the results are exchanged through shared memory.
+
+    Parameters
+    ----------
+    mosaic: canvas
+        Canvas the designs are prepared for
+    designs: list
+        List of (design configuration, source) tuples, the source is either the path of the image or the image itself
+    workers: int
+        Number of processes, by default the number of cores
+
+    Returns
+    ----------
+    results: list
+        List of (color_idx, used) tuples, in the same order as the designs
+    """
+    lut = SharedArray.fromArray(np.asarray(mosaic.getLookupTable('1x1')))
+    inputs = []
+    outputs = []
+    tasks = []
+    try:
+        for design_data, source in designs:
+            if design_data.get('size') is None:
+                # The output arrays are allocated before the workers start, so the grid of the designs without
+                # a size is detected here. The workers get the detected crop box and size.
+                image = source if isinstance(source, np.ndarray) else cv2.imread(source)
+                if image is None:
+                    raise IOError('Couldn\'t read design image: ' + source)
+                box, size = detectDesignBox(image, design_data)
+                design_data = dict(design_data, crop=box, size=list(size))
+            size = tuple(design_data['size'])
+            color_idx = SharedArray(size, lut.dtype)
+            used = SharedArray(size, bool)
+            outputs.append((color_idx, used))
+            task = {'design': design_data, 'color_table': mosaic.color_table, 'lut': lut.describe(), 
+                    'color_idx': color_idx.describe(), 'used': used.describe()}
+            if isinstance(source, np.ndarray):
+                image = SharedArray.fromArray(source)
+                inputs.append(image)
+                task['image'] = image.describe()
+            else:
+                task['path'] = source
+            tasks.append(task)
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # list() re-raises the errors of the workers
+            list(pool.map(prepareDesignWorker, tasks))
+        return [(color_idx.array.copy(), used.array.copy()) for color_idx, used in outputs]
+    finally:
+        lut.close()
+        for s in inputs + [s for pair in outputs for s in pair]:
+            s.close()
+
+def runJobs(function, jobs, workers=None):
+    """
+    Spread independent jobs across all the cores.
+
+    Parameters
+    ----------
+    function: callable
+        Function run for each job, it has to be defined at module level so it can be sent to the workers
+    jobs: list
+        Arguments of each job (tuples)
+    workers: int
+        Number of processes, by default the number of cores
+
+    Returns
+    ----------
+    results: list
+        Value returned by the function for each job, in the same order as the jobs
+    """
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(function, *job) for job in jobs]
+        return [f.result() for f in futures]
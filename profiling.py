@@ -0,0 +1,110 @@
+import cProfile
+import functools
+import json
+import os
+import time
+
+# Environment variable that enables the profiling of a run, e.g. LEGO_MOSAIC_PROFILE=1
+PROFILE_ENV = 'LEGO_MOSAIC_PROFILE'
+
+# Methods of the canvas that are timed
+PROFILED_METHODS = ['parseDesign', 'addDesign', 'quantizeDesign', 'addQuantizedDesign', 'getClosestColor',
+                    'getClosestColors', 'fill', 'fillSection', 'placePieces', 'clearRegion', 'render', 'save']
+
+def isProfilingEnabled(config=None):
+    """
+    Check if the profiling is enabled, either with the "profile" entry of the canvas configuration or with
+    the LEGO_MOSAIC_PROFILE environment variable.
+    """
+    if os.environ.get(PROFILE_ENV, '').lower() not in ('', '0', 'false', 'no'):
+        return True
+    return bool(config is not None and config.get('profile', False))
+
+class Profiler(object):
+    """
+    Record the number of calls, the cumulative time and the pieces placed by the methods of a canvas, and
+    optionally a cProfile profile of the whole run.
+
+    The methods are wrapped on the instance when instrument() is called, so a canvas that isn't instrumented
+    runs the original methods without any overhead.
+    """
+    def __init__(self, use_cprofile=True):
+        self.stats = {}
+        self.canvas = None
+        self.cprofile = cProfile.Profile() if use_cprofile else None
+        self.start_time = None
+        self.elapsed = 0.0
+
+    def instrument(self, canvas):
+        """
+        Wrap the methods of a canvas (see PROFILED_METHODS) to record their calls.
+        """
+        self.canvas = canvas
+        for name in PROFILED_METHODS:
+            method = getattr(canvas, name, None)
+            if method is not None:
+                setattr(canvas, name, self.wrap(name, method))
+
+    def wrap(self, name, method):
+        stats = self.stats.setdefault(name, {'calls': 0, 'seconds': 0.0, 'pieces': 0})
+        canvas = self.canvas
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            pieces = canvas.num_placements
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stats['seconds'] += time.perf_counter() - start
+                stats['calls'] += 1
+                stats['pieces'] += canvas.num_placements - pieces
+        return wrapper
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.elapsed += time.perf_counter() - self.start_time
+
+    def getReport(self):
+        """
+        Get the statistics of the run.
+
+        Returns
+        ----------
+        dict
+            Total time, statistics of each method (calls, cumulative time, pieces placed and pieces placed
+            per second; the time of a method includes the methods it calls) and memory used by the arrays
+            of the canvas in bytes
+        """
+        methods = {}
+        for name, stats in self.stats.items():
+            if stats['calls'] == 0:
+                continue
+            record = dict(stats)
+            record['pieces_per_second'] = stats['pieces'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+            methods[name] = record
+        memory = {}
+        if self.canvas is not None:
+            for name in ('anch_state', 'owner', 'placements', 'counts', 'prices', 'stock', 'dirty'):
+                array = getattr(self.canvas, name, None)
+                if array is not None and hasattr(array, 'nbytes'):
+                    memory[name] = int(array.nbytes)
+        return {'seconds': self.elapsed, 'methods': methods, 'memory': memory}
+
+    def save(self, output_dir):
+        """
+        Save the report as profile.json and, if enabled, the cProfile statistics as profile.prof (it can be
+        read with pstats or tools like snakeviz).
+        """
+        report_path = os.path.join(output_dir, 'profile.json')
+        with open(report_path, 'w') as outfile:
+            json.dump(self.getReport(), outfile, indent=4)
+        print('INFO: Profile saved at: ' + report_path)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(os.path.join(output_dir, 'profile.prof'))
@@ -0,0 +1,603 @@
+import json
+import os
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+# Color of the canvas where there are no pieces (BGR)
+BACKGROUND_COLOR = [200, 255, 255]
+# Color of the anchor points that aren't covered by any piece (BGR)
+ANCHOR_COLOR = [0, 0, 255]
+
+# Columns of the placement records: anchor position of the top-left corner, number of columns and rows
+# of the piece and index of its color in colors_dictionary
+PLACEMENT_X, PLACEMENT_Y, PLACEMENT_W, PLACEMENT_H, PLACEMENT_COLOR = range(5)
+
+# Files that can be written for a canvas:
+#   png: raster image of the canvas, mosaic.png (see writePlacementsPng)
+#   svg: vector image with one rect per piece, mosaic.svg (see writePlacementsSvg)
+#   table: placement records as a NumPy table, placements.npy (see writePlacementsTable)
+#   instructions: one sheet per baseplate and their bill of materials, instructions/ (see writeInstructions)
+OUTPUT_FORMATS = ('png', 'svg', 'table', 'instructions')
+
+def getOwnerGrid(placements, size):
+    """
+    Get the placement that covers each anchor of the canvas.
+
+    Parameters
+    ----------
+    placements: numpy.ndarray
+        Placement records with shape (N, 5), see PLACEMENT_X...PLACEMENT_COLOR
+    size: tuple
+        Number of anchors per row and column of the canvas
+
+    Returns
+    ----------
+    owner: numpy.ndarray
+        Matrix with shape (W, H) with the index of the placement covering each anchor, -1 if it is free
+    """
+    owner = np.full(size, -1, dtype=np.int32)
+    ids = np.arange(len(placements), dtype=np.int32)
+    # Pieces with the same size are drawn together, one offset inside the piece at a time
+    w, h = placements[:, PLACEMENT_W], placements[:, PLACEMENT_H]
+    for piece_w, piece_h in set(zip(w.tolist(), h.tolist())):
+        group = (w == piece_w) & (h == piece_h)
+        xs, ys = placements[group, PLACEMENT_X], placements[group, PLACEMENT_Y]
+        for dx in range(piece_w):
+            for dy in range(piece_h):
+                owner[xs+dx, ys+dy] = ids[group]
+    return owner
+
+class CanvasRenderer(object):
+    """
+    Render the image of a canvas from its placement records, in horizontal strips.
+
+    All the work is done at anchor (stud) level: the color of each anchor and the outlines between
+    anchors that belong to different pieces are computed once. Each strip is then expanded to pixels
+    (each anchor becomes a block of piece_size x piece_size pixels), so the memory needed depends on
+    the height of the strip and not on the size of the image.
+
+    To keep the expansion simple, the strips are rendered on a grid of blocks with an extra block of
+    background around the canvas and cropped to the image: the anchor points are in the center of the
+    first block of the image, so the image has a margin of half a block.
+
+    The grid with the placement covering each anchor (see getOwnerGrid) can be given if it is already known.
+    """
+    def __init__(self, placements, size, piece_size, color_table, owner=None):
+        if owner is None:
+            owner = getOwnerGrid(placements, size)
+        # BGR color of each anchor, the last entry of the palette is the background
+        self.palette = np.concatenate((np.asarray(color_table)[:, ::-1], [BACKGROUND_COLOR])).astype(np.uint8)
+        anchor_color = np.full(size, len(self.palette)-1)
+        anchor_color[owner >= 0] = placements[owner[owner >= 0], PLACEMENT_COLOR]
+        # Color of each block of the padded grid, (H+2, W+2)
+        self.blocks = np.pad(anchor_color.T, 1, constant_values=len(self.palette)-1)
+
+        # Outlines: compare each anchor with its neighbour, the canvas is padded with free anchors
+        padded = np.pad(owner, 1, constant_values=-1)
+        used = padded >= 0
+        # vertical[b, c]: line at the left edge of block (b, c). horizontal[b, c]: line at the top edge of block (b, c)
+        self.vertical = np.zeros(self.blocks.shape, dtype=bool)
+        self.vertical[1:-1, 1:] = ((padded[:-1, 1:-1] != padded[1:, 1:-1]) & (used[:-1, 1:-1] | used[1:, 1:-1])).T
+        self.horizontal = np.zeros(self.blocks.shape, dtype=bool)
+        self.horizontal[1:, 1:-1] = ((padded[1:-1, :-1] != padded[1:-1, 1:]) & (used[1:-1, :-1] | used[1:-1, 1:])).T
+        # Anchors that aren't covered by any piece are drawn as small points
+        self.free = np.pad(owner.T < 0, 1, constant_values=False)
+
+        self.size = size
+        self.piece_size = piece_size
+        self.margin = int(piece_size/2)
+        self.width = piece_size * (size[0]+1)
+        self.height = piece_size * (size[1]+1)
+
+    def renderBlockRows(self, start, end):
+        """
+        Render the rows of blocks [start, end) of the padded grid.
+
+        Returns
+        ----------
+        numpy.ndarray
+            BGR pixels with shape ((end-start)*piece_size, (W+2)*piece_size, 3)
+        """
+        ps = self.piece_size
+        n_cols = self.blocks.shape[1]
+        strip = self.palette[self.blocks[start:end]]
+        strip = cv2.resize(strip, (n_cols*ps, (end-start)*ps), interpolation=cv2.INTER_NEAREST)
+
+        # Each outline segment covers the pixels of its block plus the first pixel of the next one, which closes the corners
+        rows = np.arange(start*ps, end*ps)
+        block_rows, first_row = rows // ps, (rows % ps) == 0
+        previous = self.vertical[np.maximum(block_rows-1, 0)] & (block_rows > 0)[:, np.newaxis]
+        vertical = self.vertical[block_rows] | (first_row[:, np.newaxis] & previous)
+        strip[:, ::ps][vertical] = 0
+        for b in range(start, end):
+            segments = self.horizontal[b]
+            line = np.repeat(segments, ps)
+            line[ps::ps] |= segments[:-1]
+            strip[(b-start)*ps, line] = 0
+
+        # Anchor points, they may spill over the neighbouring strips
+        for dx, dy in [(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)]:
+            first = max(start-1, 0)
+            ys, xs = np.nonzero(self.free[first:end+1])
+            ys = ys + first
+            pixel_rows = ys*ps + dy - start*ps
+            inside = (pixel_rows >= 0) & (pixel_rows < (end-start)*ps)
+            strip[pixel_rows[inside], xs[inside]*ps + dx] = ANCHOR_COLOR
+        return strip
+
+    def iterStripRanges(self, strip_rows=16):
+        """
+        Get the strips the image is rendered in.
+
+        Parameters
+        ----------
+        strip_rows: int
+            Number of rows of blocks rendered at once
+
+        Yields
+        ----------
+        start, end: int
+            Rows of blocks [start, end) of the padded grid
+        first, last: int
+            Rows of pixels [first, last) of the rendered blocks that belong to the image
+        """
+        ps = self.piece_size
+        # Crop the padded grid to the image
+        offset = ps - self.margin
+        for start in range(0, self.blocks.shape[0], strip_rows):
+            end = min(start + strip_rows, self.blocks.shape[0])
+            first = max(offset - start*ps, 0)
+            last = min(offset + self.height - start*ps, (end-start)*ps)
+            if last > first:
+                yield start, end, first, last
+
+    def renderStrip(self, start, end, first, last):
+        """
+        Render a strip of the image, see iterStripRanges().
+        """
+        offset = self.piece_size - self.margin
+        return self.renderBlockRows(start, end)[first:last, offset:offset+self.width]
+
+    def iterStrips(self, strip_rows=16):
+        """
+        Render the image of the canvas strip by strip.
+
+        Parameters
+        ----------
+        strip_rows: int
+            Number of rows of blocks rendered at once
+
+        Yields
+        ----------
+        numpy.ndarray
+            BGR pixels of consecutive horizontal strips of the image
+        """
+        for strip_range in self.iterStripRanges(strip_rows):
+            yield self.renderStrip(*strip_range)
+
+    def render(self):
+        """
+        Render the whole image of the canvas.
+
+        Returns
+        ----------
+        numpy.ndarray
+            BGR image with shape (piece_size*(H+1), piece_size*(W+1), 3)
+        """
+        return np.concatenate(list(self.iterStrips()), axis=0)
+
+def renderPlacements(placements, size, piece_size, color_table, owner=None):
+    """
+    Render the image of a canvas in a single pass.
+
+    Parameters
+    ----------
+    placements: numpy.ndarray
+        Placement records with shape (N, 5), see PLACEMENT_X...PLACEMENT_COLOR
+    size: tuple
+        Number of anchors per row and column of the canvas
+    piece_size: int
+        Size of an anchor (one stud) in pixels
+    color_table: numpy.ndarray
+        RGB values of the colors with shape (C, 3)
+    owner: numpy.ndarray
+        Index of the placement covering each anchor, computed from the placements if None
+
+    Returns
+    ----------
+    img: numpy.ndarray
+        BGR image with shape (piece_size*(H+1), piece_size*(W+1), 3)
+    """
+    return CanvasRenderer(placements, size, piece_size, color_table, owner).render()
+
+class PngWriter(object):
+    """
+    Write a PNG image row by row, so the whole image never needs to be in memory. The destination is either
+    a path or a binary file object (e.g. io.BytesIO), which is left open.
+    """
+    def __init__(self, path, width, height, compression=3):
+        self.own_file = isinstance(path, (str, bytes, os.PathLike))
+        self.file = open(path, 'wb') if self.own_file else path
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(compression)
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        # 8 bits per channel, RGB, no interlacing
+        self.writeChunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def writeChunk(self, chunk_type, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    def writeRows(self, rows):
+        """
+        Append rows to the image.
+
+        Parameters
+        ----------
+        rows: numpy.ndarray
+            BGR pixels with shape (n, width, 3)
+        """
+        # Each row starts with its filter type (0: none)
+        data = np.zeros((rows.shape[0], 1 + self.width*3), dtype=np.uint8)
+        data[:, 1:] = rows[:, :, ::-1].reshape(rows.shape[0], -1)
+        compressed = self.compressor.compress(data.tobytes())
+        if compressed:
+            self.writeChunk(b'IDAT', compressed)
+        self.rows_written += rows.shape[0]
+
+    def close(self):
+        if self.rows_written != self.height:
+            self.closeFile()
+            raise ValueError('Expected ' + str(self.height) + ' rows, got ' + str(self.rows_written))
+        self.writeChunk(b'IDAT', self.compressor.flush())
+        self.writeChunk(b'IEND', b'')
+        self.closeFile()
+
+    def closeFile(self):
+        if self.own_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.closeFile()
+
+class PngReader(object):
+    """
+    Read a PNG image written by PngWriter row by row, so the whole image never needs to be in memory. Only
+    8 bits RGB images without interlacing nor filters are supported.
+    """
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.decompressor = zlib.decompressobj()
+        self.buffer = b''
+        try:
+            if self.file.read(8) != b'\x89PNG\r\n\x1a\n':
+                raise ValueError('Not a PNG file: ' + path)
+            chunk_type, data = self.readChunk()
+            if chunk_type != b'IHDR':
+                raise ValueError('Missing PNG header: ' + path)
+            self.width, self.height, depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', data)
+            if (depth, color_type, interlace) != (8, 2, 0):
+                raise ValueError('Unsupported PNG format: ' + path)
+        except (ValueError, struct.error):
+            self.file.close()
+            raise
+
+    def readChunk(self):
+        length = struct.unpack('>I', self.file.read(4))[0]
+        chunk_type = self.file.read(4)
+        data = self.file.read(length)
+        self.file.read(4)
+        return chunk_type, data
+
+    def readRows(self, n):
+        """
+        Read the next rows of the image.
+
+        Returns
+        ----------
+        numpy.ndarray
+            BGR pixels with shape (n, width, 3)
+        """
+        row_bytes = 1 + self.width*3
+        while len(self.buffer) < n*row_bytes:
+            chunk_type, data = self.readChunk()
+            if chunk_type == b'IDAT':
+                self.buffer += self.decompressor.decompress(data)
+            elif chunk_type == b'IEND' or chunk_type == b'':
+                raise ValueError('Unexpected end of the PNG data')
+        data = np.frombuffer(self.buffer[:n*row_bytes], dtype=np.uint8).reshape(n, row_bytes)
+        self.buffer = self.buffer[n*row_bytes:]
+        if np.any(data[:, 0] != 0):
+            raise ValueError('Unsupported PNG filter')
+        return data[:, 1:].reshape(n, self.width, 3)[:, :, ::-1]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def writePlacementsPng(path, placements, size, piece_size, color_table, strip_rows=16, compression=3, owner=None):
+    """
+    Render the image of a canvas and write it to a PNG file strip by strip. The peak memory is given by the
+    height of the strips, not by the size of the canvas.
+
+    Parameters
+    ----------
+    path: str
+        Path of the PNG file, or binary file object where it is written
+    placements: numpy.ndarray
+        Placement records with shape (N, 5), see PLACEMENT_X...PLACEMENT_COLOR
+    size: tuple
+        Number of anchors per row and column of the canvas
+    piece_size: int
+        Size of an anchor (one stud) in pixels
+    color_table: numpy.ndarray
+        RGB values of the colors with shape (C, 3)
+    strip_rows: int
+        Number of rows of anchors rendered at once
+    compression: int
+        zlib compression level (0-9)
+    owner: numpy.ndarray
+        Index of the placement covering each anchor, computed from the placements if None
+    """
+    renderer = CanvasRenderer(placements, size, piece_size, color_table, owner)
+    with PngWriter(path, renderer.width, renderer.height, compression) as writer:
+        for strip in renderer.iterStrips(strip_rows):
+            writer.writeRows(strip)
+
+def updatePlacementsPng(path, placements, size, piece_size, color_table, dirty_rows, strip_rows=16, compression=3, 
+                        owner=None):
+    """
+    Update the PNG file of a canvas after some of its anchors changed. Only the strips that contain changed
+    rows are rendered again, the rest of the pixels are copied from the previous image. If the previous image
+    can't be used, the whole image is rendered.
+
+    Parameters
+    ----------
+    path: str
+        Path of the PNG file, written by writePlacementsPng()
+    placements: numpy.ndarray
+        Placement records with shape (N, 5), see PLACEMENT_X...PLACEMENT_COLOR
+    size: tuple
+        Number of anchors per row and column of the canvas
+    piece_size: int
+        Size of an anchor (one stud) in pixels
+    color_table: numpy.ndarray
+        RGB values of the colors with shape (C, 3)
+    dirty_rows: numpy.ndarray
+        Boolean array with shape (H,), True for the rows of anchors that changed
+    strip_rows: int
+        Number of rows of anchors rendered at once
+    compression: int
+        zlib compression level (0-9)
+    owner: numpy.ndarray
+        Index of the placement covering each anchor, computed from the placements if None
+
+    Returns
+    ----------
+    int
+        Number of strips rendered
+    """
+    renderer = CanvasRenderer(placements, size, piece_size, color_table, owner)
+    ranges = list(renderer.iterStripRanges(strip_rows))
+    # Rows of blocks of the padded grid that changed. The outlines and anchor points of a block are drawn 
+    # over its neighbours, so the neighbouring rows change too.
+    dirty = np.zeros(renderer.blocks.shape[0] + 2, dtype=bool)
+    dirty[2:-2] = dirty_rows
+    dirty = dirty[:-2] | dirty[1:-1] | dirty[2:]
+    try:
+        reader = PngReader(path)
+    except (IOError, ValueError):
+        reader = None
+    if reader is None or (reader.width, reader.height) != (renderer.width, renderer.height):
+        if reader is not None:
+            reader.close()
+        writePlacementsPng(path, placements, size, piece_size, color_table, strip_rows, compression, owner)
+        return len(ranges)
+
+    rendered = 0
+    tmp_path = path + '.tmp'
+    try:
+        with reader, PngWriter(tmp_path, renderer.width, renderer.height, compression) as writer:
+            for start, end, first, last in ranges:
+                previous = reader.readRows(last - first)
+                if dirty[start:end].any():
+                    writer.writeRows(renderer.renderStrip(start, end, first, last))
+                    rendered += 1
+                else:
+                    writer.writeRows(previous)
+    except (IOError, ValueError, struct.error, zlib.error):
+        # The previous image is broken, render it again
+        os.remove(tmp_path)
+        writePlacementsPng(path, placements, size, piece_size, color_table, strip_rows, compression, owner)
+        return len(ranges)
+    os.replace(tmp_path, path)
+    return rendered
+
+def getColorHex(color_table):
+    """
+    Get the SVG colors (e.g. '#f4f4f4') of a color table with RGB values.
+    """
+    return ['#%02x%02x%02x' % tuple(c) for c in np.clip(np.round(color_table), 0, 255).astype(int).tolist()]
+
+def getSvgRects(placements, colors, origin=(0, 0)):
+    """
+    Get one SVG rect per placement, in anchor (stud) units.
+
+    Parameters
+    ----------
+    placements: numpy.ndarray
+        Placement records with shape (N, 5), see PLACEMENT_X...PLACEMENT_COLOR
+    colors: list
+        SVG color of each color index, see getColorHex()
+    origin: tuple
+        Anchor position subtracted from the positions of the placements
+
+    Returns
+    ----------
+    list
+        SVG elements
+    """
+    return ['<rect x="%d" y="%d" width="%d" height="%d" fill="%s"/>' % (x - origin[0], y - origin[1], w, h, colors[c])
+            for x, y, w, h, c in placements.tolist()]
+
+def writeSvg(path, rects, size, piece_size, extra=()):
+    """
+    Write an SVG image with one unit per anchor (stud), the pieces are outlined in black.
+    """
+    with open(path, 'w') as outfile:
+        outfile.write('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d">\n' 
+                      % (size[0]*piece_size, size[1]*piece_size, size[0], size[1]))
+        outfile.write('<rect width="%d" height="%d" fill="#%02x%02x%02x"/>\n' % ((size[0], size[1]) + tuple(BACKGROUND_COLOR[::-1])))
+        outfile.write('<g stroke="#000000" stroke-width="0.05">\n')
+        outfile.write('\n'.join(rects))
+        outfile.write('\n</g>\n')
+        for element in extra:
+            outfile.write(element + '\n')
+        outfile.write('</svg>\n')
+
+def writePlacementsSvg(path, placements, size, piece_size, color_table):
+    """
+    Write the canvas as an SVG image with one rect per piece. The file grows with the number of pieces and 
+    not with the number of pixels.
+
+    Parameters
+    ----------
+    path: str
+        Path of the SVG file
+    placements: numpy.ndarray
+        Placement records with shape (N, 5), see PLACEMENT_X...PLACEMENT_COLOR
+    size: tuple
+        Number of anchors per row and column of the canvas
+    piece_size: int
+        Size of an anchor (one stud) in pixels, used for the default size of the image
+    color_table: numpy.ndarray
+        RGB values of the colors with shape (C, 3)
+    """
+    writeSvg(path, getSvgRects(placements, getColorHex(color_table)), size, piece_size)
+
+def writePlacementsTable(path, placements):
+    """
+    Write the placement records as a NumPy (.npy) int32 table with shape (N, 5): anchor position of the 
+    top-left corner, number of columns and rows of the piece and index of its color in colors_dictionary.
+    """
+    np.save(path, np.ascontiguousarray(placements, dtype=np.int32))
+
+def getPieceList(placements, origin, color_names):
+    """
+    Get the pieces of a baseplate for instructions.json: position relative to the baseplate, number of columns
+    and rows and color name.
+    """
+    return [[x - origin[0], y - origin[1], w, h, str(color_names[c])] for x, y, w, h, c in placements.tolist()]
+
+def writeInstructions(output_dir, placements, size, piece_size, color_table, color_names, plate_size=32):
+    """
+    Write the building instructions of the canvas split in baseplates of plate_size x plate_size anchors: 
+    one SVG sheet per baseplate (plate_<row>_<column>.svg) and instructions.json with the pieces of each 
+    baseplate (position inside the baseplate, number of columns and rows, color) and their bill of materials.
+    A piece is placed on the baseplate of its top-left anchor ("pieces"), and it is also listed on the other
+    baseplates it overlaps ("continued", drawn hatched on their sheets) so every stud of a sheet is shown. The 
+    bill of materials of a baseplate only counts the pieces placed on it. The pieces are grouped by baseplate 
+    with a single sort, so the time grows with the number of pieces.
+
+    Parameters
+    ----------
+    output_dir: str
+        Directory where the sheets are written, it is created if needed
+    placements: numpy.ndarray
+        Placement records with shape (N, 5), see PLACEMENT_X...PLACEMENT_COLOR
+    size: tuple
+        Number of anchors per row and column of the canvas
+    piece_size: int
+        Size of an anchor (one stud) in pixels, used for the default size of the sheets
+    color_table: numpy.ndarray
+        RGB values of the colors with shape (C, 3)
+    color_names: numpy.ndarray
+        Name of each color
+    plate_size: int
+        Number of anchors per row and column of a baseplate
+
+    Returns
+    ----------
+    int
+        Number of baseplates
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    colors = getColorHex(color_table)
+    plates_x = -(-size[0] // plate_size)
+    plates_y = -(-size[1] // plate_size)
+    xs, ys = placements[:, PLACEMENT_X], placements[:, PLACEMENT_Y]
+    first_x, first_y = xs // plate_size, ys // plate_size
+    last_x = (xs + placements[:, PLACEMENT_W] - 1) // plate_size
+    last_y = (ys + placements[:, PLACEMENT_H] - 1) // plate_size
+    # Each piece is listed on the baseplate of its top-left anchor and on the next ones it overlaps. The pieces 
+    # are smaller than a baseplate, so they overlap at most one more baseplate in each direction.
+    indices, plates, continued = [], [], []
+    for dx in range(2):
+        for dy in range(2):
+            selected = np.nonzero((first_x + dx <= last_x) & (first_y + dy <= last_y))[0]
+            indices.append(selected)
+            plates.append((first_y[selected] + dy) * plates_x + first_x[selected] + dx)
+            continued.append(np.full(len(selected), dx + dy > 0))
+    indices, plates, continued = np.concatenate(indices), np.concatenate(plates), np.concatenate(continued)
+    order = np.argsort(plates, kind='stable')
+    bounds = np.searchsorted(plates[order], np.arange(plates_x*plates_y + 1))
+    # Pieces are identified by their size, e.g. a piece of 4 columns and 2 rows is a '2x4'
+    w, h = placements[:, PLACEMENT_W], placements[:, PLACEMENT_H]
+    piece_codes = np.minimum(w, h) * 10 + np.maximum(w, h)
+
+    sheets = []
+    for index in range(plates_x * plates_y):
+        row, col = divmod(index, plates_x)
+        origin = (col*plate_size, row*plate_size)
+        plate_dims = (min(plate_size, size[0] - origin[0]), min(plate_size, size[1] - origin[1]))
+        listed = order[bounds[index]:bounds[index+1]]
+        own = indices[listed[~continued[listed]]]
+        other = indices[listed[continued[listed]]]
+        name = 'plate_' + str(row) + '_' + str(col)
+
+        # The pieces continued from other baseplates are hatched, and the grid of the studs of the baseplate is 
+        # drawn over the pieces
+        extra = []
+        if len(other) > 0:
+            extra.append('<defs><pattern id="continued" width="0.5" height="0.5" patternUnits="userSpaceOnUse">'
+                         '<path d="M0 0.5L0.5 0" stroke="#000000" stroke-width="0.05"/></pattern></defs>')
+            extra.append('<g fill="url(#continued)" stroke="none">')
+            extra += ['<rect x="%d" y="%d" width="%d" height="%d"/>' % (x - origin[0], y - origin[1], pw, ph)
+                      for x, y, pw, ph, c in placements[other].tolist()]
+            extra.append('</g>')
+        extra.append('<path d="' + ''.join('M%d 0V%d' % (i, plate_dims[1]) for i in range(1, plate_dims[0])) 
+                     + ''.join('M0 %dH%d' % (i, plate_dims[0]) for i in range(1, plate_dims[1])) 
+                     + '" stroke="#808080" stroke-width="0.02" fill="none"/>')
+        writeSvg(os.path.join(output_dir, name + '.svg'), getSvgRects(placements[np.concatenate((own, other))], colors, origin),
+                 plate_dims, piece_size, extra)
+
+        bill = {}
+        codes, counts = np.unique(piece_codes[own] * len(color_names) + placements[own, PLACEMENT_COLOR], return_counts=True)
+        for code, count in zip(codes.tolist(), counts.tolist()):
+            piece, color = divmod(code, len(color_names))
+            bill.setdefault(str(piece // 10) + 'x' + str(piece % 10), {})[str(color_names[color])] = count
+        sheets.append({'name': name, 'origin': list(origin), 'size': list(plate_dims), 'bill': bill, 
+                       'pieces': getPieceList(placements[own], origin, color_names), 
+                       'continued': getPieceList(placements[other], origin, color_names)})
+
+    with open(os.path.join(output_dir, 'instructions.json'), 'w') as outfile:
+        json.dump({'plate_size': plate_size, 'plates': sheets}, outfile)
+    return len(sheets)
@@ -0,0 +1,145 @@
+import argparse
+import base64
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from api import MosaicGenerator, encodePng, loadConfig
+
+# Biggest request accepted by the service, in bytes
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+def decodeImage(data):
+    """
+    Decode an image sent to the service.
+
+    Parameters
+    ----------
+    data: str
+        Base64 encoded image file (PNG, JPEG...)
+
+    Returns
+    ----------
+    image: numpy.ndarray
+        BGR image
+    """
+    buffer = np.frombuffer(base64.b64decode(data), dtype=np.uint8)
+    image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError('Couldn\'t decode design image')
+    return image
+
+def handleMosaicRequest(generator, request):
+    """
+    Generate the mosaic of a request.
+
+    Parameters
+    ----------
+    generator: MosaicGenerator
+        Generator with the canvas configuration of the service
+    request: dict
+        {"designs": [...]} where each design has the same format as the designs of conf.json, but with the
+        base64 encoded image file in "image" instead of "path"
+
+    Returns
+    ----------
+    dict
+        Bill of materials ("summary", same format as summary.json), "total price", "pieces" and the base64
+        encoded PNG image of the mosaic ("png")
+    """
+    if not isinstance(request, dict) or not isinstance(request.get('designs', []), list):
+        raise ValueError('The request has to be {"designs": [...]}')
+    designs = []
+    for design_data in request.get('designs', []):
+        if not isinstance(design_data, dict) or 'image' not in design_data or 'position' not in design_data:
+            raise ValueError('Every design needs an "image" and a "position"')
+        designs.append((design_data, decodeImage(design_data['image'])))
+    mosaic = generator.generate(designs)
+    return {'summary': mosaic.getSummary(), 'total price': mosaic.getTotalPrice(), 'pieces': mosaic.num_placements,
+            'png': base64.b64encode(encodePng(mosaic)).decode('ascii')}
+
+class MosaicRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the service requests:
+        - GET /health: {"status": "ok"}
+        - POST /mosaic: see handleMosaicRequest()
+    The errors are answered with {"error": message}: 400 for invalid requests and 500 for unexpected errors.
+    """
+    def sendJson(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.sendJson(200, {'status': 'ok'})
+        else:
+            self.sendJson(404, {'error': 'Unknown path: ' + self.path})
+
+    def do_POST(self):
+        if self.path != '/mosaic':
+            self.sendJson(404, {'error': 'Unknown path: ' + self.path})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        if length <= 0 or length > MAX_REQUEST_SIZE:
+            self.sendJson(400, {'error': 'Invalid request size: ' + str(length)})
+            return
+        try:
+            request = json.loads(self.rfile.read(length))
+            response = handleMosaicRequest(self.server.generator, request)
+        except (ValueError, KeyError, TypeError, IOError) as e:
+            self.sendJson(400, {'error': str(e)})
+            return
+        except Exception as e:
+            # Any other error still gets an answer instead of dropping the connection
+            self.sendJson(500, {'error': type(e).__name__ + ': ' + str(e)})
+            return
+        self.sendJson(200, response)
+
+def createServer(config, host='127.0.0.1', port=8000, base_dir='.'):
+    """
+    Create the mosaic service. The canvas and its lookup tables are prepared once, when the service starts,
+    and each request is served in its own thread with its own empty copy of the canvas.
+
+    Parameters
+    ----------
+    config: dict
+        Configuration data with the same format as conf.json, only "canvas_config" is used
+    host: str
+        Address the service listens on
+    port: int
+        Port the service listens on
+    base_dir: str
+        Directory used to resolve the path of the inventory
+
+    Returns
+    ----------
+    ThreadingHTTPServer
+        Server, call serve_forever() to start it
+    """
+    server = ThreadingHTTPServer((host, port), MosaicRequestHandler)
+    server.daemon_threads = True
+    server.generator = MosaicGenerator(config['canvas_config'], base_dir)
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Lego mosaic generator service')
+    parser.add_argument('--config', default='./conf.json', help='configuration file with the canvas of the mosaics')
+    parser.add_argument('--host', default='127.0.0.1', help='address the service listens on')
+    parser.add_argument('--port', type=int, default=8000, help='port the service listens on')
+    args = parser.parse_args()
+
+    server = createServer(loadConfig(args.config), args.host, args.port, os.path.dirname(os.path.abspath(args.config)))
+    print('INFO: Serving mosaics at http://' + args.host + ':' + str(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,191 @@
+import json
+import os
+
+import numpy as np
+
+from api import createCanvas, quantizeDesigns
+from parallel import runJobs
+from render import writeInstructions, writePlacementsSvg, writePlacementsTable, PLACEMENT_H, PLACEMENT_W, PLACEMENT_X, PLACEMENT_Y
+
+def getShards(size, shard_size):
+    """
+    Split a canvas into shards of shard_size x shard_size anchors, the shards of the right and bottom edges
+    are smaller if the size of the canvas isn't a multiple of shard_size.
+
+    Parameters
+    ----------
+    size: tuple
+        Number of anchors per row and column of the canvas
+    shard_size: int
+        Number of anchors per row and column of a shard
+
+    Returns
+    ----------
+    shards: list
+        List of (name, origin, size) tuples, in row order
+    """
+    shards = []
+    for row, y in enumerate(range(0, size[1], shard_size)):
+        for col, x in enumerate(range(0, size[0], shard_size)):
+            shards.append(('shard_' + str(row) + '_' + str(col), (x, y), (min(shard_size, size[0] - x), min(shard_size, size[1] - y))))
+    return shards
+
+def cropDesigns(designs, origin, size):
+    """
+    Get the parts of the designs that fall inside a shard.
+
+    Parameters
+    ----------
+    designs: list
+        List of (position, color_idx, used) tuples in canvas coordinates, in the order they are added
+    origin: tuple
+        Anchor position of the top-left corner of the shard
+    size: tuple
+        Number of anchors per row and column of the shard
+
+    Returns
+    ----------
+    list
+        List of (position, color_idx, used) tuples in shard coordinates
+    """
+    cropped = []
+    for pos, color_idx, used in designs:
+        start = [max(pos[i], origin[i]) for i in range(2)]
+        end = [min(pos[i] + used.shape[i], origin[i] + size[i]) for i in range(2)]
+        if start[0] >= end[0] or start[1] >= end[1]:
+            continue
+        region = (slice(start[0] - pos[0], end[0] - pos[0]), slice(start[1] - pos[1], end[1] - pos[1]))
+        cropped.append(((start[0] - origin[0], start[1] - origin[1]), color_idx[region].copy(), used[region].copy()))
+    return cropped
+
+def generateShards(canvas_data, base_dir, shards, output_dir, stock=None):
+    """
+    Generate a group of shards one after the other. The canvas is prepared once and each shard starts from
+    an empty copy of it, so the memory and time of a shard don't depend on the size of the wall. It is defined
+    at module level so it can run in a worker process.
+
+    Parameters
+    ----------
+    canvas_data: dict
+        Configuration of the canvas, with the size of the biggest shard, see api.createCanvas()
+    base_dir: str
+        Directory used to resolve the path of the inventory
+    shards: list
+        List of (name, origin, size, designs) tuples, see getShards() and cropDesigns()
+    output_dir: str
+        Directory where the image of each shard is written (<name>.png), if "png" is in the output formats
+    stock: numpy.ndarray
+        Stock available for the shards, with the same format as canvas.stock. None to use the inventory of the
+        configuration. The stock left by a shard is used by the next one.
+
+    Returns
+    ----------
+    results: list
+        List of (placements in canvas coordinates, counts, price) tuples, one per shard
+    stock: numpy.ndarray
+        Stock left after all the shards, None if there is no inventory
+    """
+    template = createCanvas(canvas_data, headless=True, base_dir=base_dir)
+    if stock is not None:
+        template.stock = stock
+    results = []
+    for name, origin, size, designs in shards:
+        shard = template.emptyCopy(size)
+        for pos, color_idx, used in designs:
+            shard.addQuantizedDesign(pos, color_idx, used)
+        shard.fill()
+        if 'png' in shard.output_formats:
+            shard.writePng(os.path.join(output_dir, name + '.png'))
+        placements = shard.getPlacements().copy()
+        placements[:, PLACEMENT_X] += origin[0]
+        placements[:, PLACEMENT_Y] += origin[1]
+        results.append((placements, shard.counts, shard.getTotalPrice()))
+        template.stock = shard.stock
+    return results, template.stock
+
+def generateShardedMosaic(config, output_dir='./', base_dir='.', workers=1):
+    """
+    Generate a mosaic split in baseplate-sized shards ("shard_size" in the canvas configuration). The designs
+    are quantized once for the whole canvas, so the dithering is continuous across the shards, and the designs
+    that straddle a boundary are split between the shards they cover. Each shard is then filled on its own, so
+    no piece crosses a boundary, and the shards are spread across the workers. The bill of materials of all
+    the shards is merged into summary.json and shards.json describes each shard. The image of each shard is
+    written to shards/<name>.png, while the other output formats are written for the whole canvas.
+
+    With an inventory, the stock left by a shard is used by the next one, so the shards are generated one
+    after the other.
+
+    Parameters
+    ----------
+    config: dict
+        Configuration data with the same format as conf.json
+    output_dir: str
+        Directory where the results are written
+    base_dir: str
+        Directory used to resolve design paths that are not relative to the working directory
+    workers: int
+        Number of processes
+
+    Returns
+    ----------
+    dict
+        Merged bill of materials, same format as summary.json
+    """
+    canvas_data = config['canvas_config']
+    shard_size = canvas_data['shard_size']
+    size = (canvas_data['blocks_per_row'], canvas_data['blocks_per_col'])
+    # The canvases only need to be as big as a shard
+    shard_data = dict(canvas_data, blocks_per_row=min(shard_size, size[0]), blocks_per_col=min(shard_size, size[1]))
+    template = createCanvas(shard_data, headless=True, base_dir=base_dir)
+
+    designs_data = config.get('designs', {})
+    quantized = quantizeDesigns(template, designs_data, base_dir, workers)
+    designs = [(tuple(designs_data[e]['position']),) + quantized[e][1:] for e in designs_data]
+    shards = [(name, origin, shard_dims, cropDesigns(designs, origin, shard_dims))
+              for name, origin, shard_dims in getShards(size, shard_size)]
+
+    shards_dir = os.path.join(output_dir, 'shards')
+    os.makedirs(shards_dir, exist_ok=True)
+    if template.stock is not None and workers > 1:
+        print('WARNING: The shards share the stock of the inventory, they are generated in a single process')
+        workers = 1
+    if workers > 1:
+        chunks = [shards[i::workers] for i in range(workers)]
+        outputs = runJobs(generateShards, [(shard_data, base_dir, chunk, shards_dir) for chunk in chunks if chunk], workers)
+        # Put the results back in the order of the shards
+        results = [None] * len(shards)
+        for i, (chunk_results, _) in enumerate(outputs):
+            results[i::workers] = chunk_results
+        stock = None
+    else:
+        results, stock = generateShards(shard_data, base_dir, shards, shards_dir, template.stock)
+
+    # Merge the bill of materials of the shards
+    template.counts = np.sum([counts for _, counts, _ in results], axis=0)
+    template.stock = stock
+    summary = template.getSummary()
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as outfile:
+        json.dump(summary, outfile, indent=4)
+    index = [{'name': name, 'origin': list(origin), 'size': list(shard_dims), 'pieces': len(placements), 'price': price}
+             for (name, origin, shard_dims, _), (placements, _, price) in zip(shards, results)]
+    with open(os.path.join(output_dir, 'shards.json'), 'w') as outfile:
+        json.dump(index, outfile, indent=4)
+    print('INFO: Generated ' + str(len(shards)) + ' shards of ' + str(shard_size) + 'x' + str(shard_size))
+    print('INFO: The total price for the mosaic is: ' + str(np.round(template.getTotalPrice())) + ' DKK')
+    if stock is not None:
+        uncovered = size[0]*size[1] - sum(int((p[:, PLACEMENT_W]*p[:, PLACEMENT_H]).sum()) for p, _, _ in results)
+        if uncovered > 0:
+            print('WARNING: ' + str(uncovered) + ' anchors couldn\'t be covered with the available stock')
+
+    placements = np.concatenate([p for p, _, _ in results])
+    try:
+        if 'svg' in template.output_formats:
+            writePlacementsSvg(os.path.join(output_dir, 'mosaic.svg'), placements, size, template.piece_size, template.color_table)
+        if 'table' in template.output_formats:
+            writePlacementsTable(os.path.join(output_dir, 'placements.npy'), placements)
+        if 'instructions' in template.output_formats:
+            writeInstructions(os.path.join(output_dir, 'instructions'), placements, size, template.piece_size,
+                              template.color_table, template.color_names, template.plate_size)
+    except (IOError, ValueError) as e:
+        print('ERROR: Couldn\'t save canvas outputs: ' + str(e))
+    return summary
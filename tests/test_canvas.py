@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pytest
+
+from api import loadConfig
+from utils import canvas
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'conf.json')
+
+def createCanvas(size, tmp_path, **kwargs):
+    valid_pieces = loadConfig(CONFIG_PATH)['canvas_config']['valid_pieces']
+    return canvas(size, valid_pieces, headless=True, cache_dir=str(tmp_path), **kwargs)
+
+def getDesign(mosaic, size, seed=0):
+    # Patches of a few colors of the 1x1 palette, like a pixel art design
+    rng = np.random.RandomState(seed)
+    colors = rng.choice(mosaic.palette_idx['1x1'], size=6, replace=False)
+    coarse = rng.randint(0, len(colors), size=(size[0]//3 + 1, size[1]//3 + 1))
+    color_idx = colors[np.kron(coarse, np.ones((3, 3), dtype=int))[:size[0], :size[1]]]
+    used = rng.rand(*size) < 0.9
+    return color_idx, used
+
+@pytest.mark.parametrize('seed', range(5))
+def test_merged_design_optimal_not_worse_than_greedy(tmp_path, seed):
+    results = {}
+    for mode in ('greedy', 'price', 'count'):
+        mosaic = createCanvas((40, 30), tmp_path, fill_mode=mode)
+        color_idx, used = getDesign(mosaic, (30, 20), seed)
+        mosaic.addQuantizedDesign((5, 5), color_idx, used)
+        placements = mosaic.getPlacements()
+        # The design blocks keep their colors
+        grid = np.full(mosaic.size, -1)
+        for x, y, w, h, color in placements:
+            grid[x:x+w, y:y+h] = color
+        assert (grid[5:35, 5:25][used] == color_idx[used]).all()
+        results[mode] = (mosaic.getTotalPrice(), mosaic.num_placements)
+    assert results['price'][0] <= results['greedy'][0] + 1e-6
+    assert results['count'][1] <= results['greedy'][1]
@@ -0,0 +1,45 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from api import loadConfig, resolvePath
+from utils import getDesignGrid, sampleDesign
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DESIGNS = loadConfig(os.path.join(ROOT, 'conf.json'))['designs']
+
+@pytest.mark.parametrize('name', sorted(DESIGNS))
+@pytest.mark.parametrize('configured_size', [True, False])
+def test_sample_designs_are_aligned(name, configured_size):
+    design_data = dict(DESIGNS[name])
+    if not configured_size:
+        del design_data['size']
+    image = cv2.imread(resolvePath(design_data['path'], ROOT))
+    assert image is not None
+    roi, size = getDesignGrid(image, design_data)
+    assert size == tuple(DESIGNS[name]['size'])
+    # With the grid aligned, the center of each block has the color of the whole block
+    center = sampleDesign(roi, size, 'center').astype(int)
+    median = sampleDesign(roi, size, 'median').astype(int)
+    wrong = (np.abs(center - median).max(axis=2) > 30).sum()
+    assert wrong <= 0.02 * size[0] * size[1]
+
+def test_full_bleed_design_with_frame():
+    # 10x10 blocks of 8 pixels, with a frame of two blocks of the same color touching the border of the image
+    rng = np.random.RandomState(0)
+    blocks = rng.randint(0, 256, size=(10, 10, 3)).astype(np.uint8)
+    blocks[:2] = blocks[-2:] = blocks[:, :2] = blocks[:, -2:] = [40, 120, 200]
+    image = np.kron(blocks, np.ones((8, 8, 1), dtype=np.uint8))
+    roi, size = getDesignGrid(image, {'size': [10, 10]})
+    assert size == (10, 10)
+    design = sampleDesign(roi, size, 'center')
+    assert (design.transpose(1, 0, 2) == blocks).all()
+
+@pytest.mark.parametrize('shape', [(1, 1, 3), (1, 40, 3), (40, 1, 3)])
+def test_tiny_image_is_a_single_block(shape):
+    image = np.full(shape, 100, dtype=np.uint8)
+    roi, size = getDesignGrid(image, {})
+    assert size == (1, 1)
+    assert (sampleDesign(roi, size, 'center') == 100).all()
@@ -0,0 +1,69 @@
+import copy
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from api import loadConfig, quantizeDesigns
+from main import generateMosaic
+from render import getOwnerGrid, renderPlacements, PLACEMENT_COLOR, PLACEMENT_H, PLACEMENT_W
+from utils import getPieceSize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def config():
+    config = loadConfig(os.path.join(ROOT, 'conf.json'))
+    for design in config['designs'].values():
+        design['path'] = os.path.join(ROOT, design['path'])
+    return config
+
+def moveDesign(config):
+    # Next to the pieces that fill the space between the other designs
+    config['designs']['hearth']['position'] = [25, 45]
+
+def removeDesign(config):
+    del config['designs']['avocado']
+
+def changeOptions(config):
+    config['designs']['bender']['keep white'] = False
+
+def getColorGrid(mosaic):
+    return mosaic.getPlacements()[mosaic.owner, PLACEMENT_COLOR]
+
+@pytest.mark.parametrize('change', [moveDesign, removeDesign, changeOptions])
+def test_incremental_update_matches_rebuild(config, tmp_path, change):
+    output_dir, rebuild_dir = str(tmp_path / 'incremental'), str(tmp_path / 'rebuild')
+    os.makedirs(output_dir)
+    os.makedirs(rebuild_dir)
+    generateMosaic(config, output_dir, headless=True)
+    change(config)
+    mosaic = generateMosaic(config, output_dir, headless=True, incremental=True)
+    rebuild = generateMosaic(copy.deepcopy(config), rebuild_dir, headless=True)
+
+    # Every anchor is covered by exactly one piece and the owners match the placements
+    placements = mosaic.getPlacements()
+    assert (mosaic.anch_state == 1).all()
+    assert (mosaic.owner == getOwnerGrid(placements, mosaic.size)).all()
+    assert (placements[:, PLACEMENT_W] * placements[:, PLACEMENT_H]).sum() == mosaic.size[0] * mosaic.size[1]
+
+    # The counters match the placements
+    counts = np.zeros(mosaic.counts.shape, dtype=np.int64)
+    for e in mosaic.piece_keys:
+        rows, cols = getPieceSize(e)
+        group = placements[(placements[:, PLACEMENT_W] == cols) & (placements[:, PLACEMENT_H] == rows)]
+        np.add.at(counts[mosaic.piece_index[e]], group[:, PLACEMENT_COLOR], 1)
+    assert (counts == mosaic.counts).all()
+
+    # The blocks of the designs have the same colors as in a canvas generated from scratch, the rest is filled 
+    # with random colors
+    used = np.zeros(mosaic.size, dtype=bool)
+    for element, (_, _, design_used) in quantizeDesigns(rebuild, config['designs']).items():
+        x, y = config['designs'][element]['position']
+        used[x:x+design_used.shape[0], y:y+design_used.shape[1]] |= design_used
+    assert (getColorGrid(mosaic)[used] == getColorGrid(rebuild)[used]).all()
+
+    # Only the changed strips of the image are rendered again, the result is the same as rendering it as a whole
+    image = cv2.imread(os.path.join(output_dir, 'mosaic.png'))
+    assert (image == renderPlacements(placements, mosaic.size, mosaic.piece_size, mosaic.color_table)).all()
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+
+from api import loadConfig
+from color_matching import getColorDistances
+from utils import canvas
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'conf.json')
+
+def createCanvas(size, tmp_path, inventory, **kwargs):
+    valid_pieces = loadConfig(CONFIG_PATH)['canvas_config']['valid_pieces']
+    return canvas(size, valid_pieces, headless=True, cache_dir=str(tmp_path), inventory=inventory, **kwargs)
+
+def getClosestColors(mosaic, color, candidates):
+    # Candidates sorted by their distance to the color in the 1x1 palette
+    palette = mosaic.color_table[[mosaic.color_index[c] for c in [color] + candidates]]
+    distances = getColorDistances(palette[:1], palette[1:], mosaic.color_metric)[0]
+    return [candidates[i] for i in np.argsort(distances)]
+
+@pytest.mark.parametrize('merge_design_blocks', [True, False])
+def test_stock_is_never_exceeded(tmp_path, merge_design_blocks):
+    inventory = {'1x1': {'Bright Red': 30, 'Bright Blue': 40, 'White': 20, 'Black': 200},
+                 '2x2': {'Bright Red': 5, 'Bright Blue': 10},
+                 '2x4': {'Black': 10, 'White': 10}}
+    mosaic = createCanvas((30, 20), tmp_path, inventory, merge_design_blocks=merge_design_blocks)
+    red, blue = mosaic.color_index['Bright Red'], mosaic.color_index['Bright Blue']
+    # More red blocks than red pieces, the rest have to be substituted
+    color_idx = np.full((20, 15), red)
+    color_idx[10:] = blue
+    used = np.ones(color_idx.shape, dtype=bool)
+    mosaic.addQuantizedDesign((5, 3), color_idx, used)
+    mosaic.fill()
+
+    assert (mosaic.stock >= 0).all()
+    summary = mosaic.getSummary()
+    for e in mosaic.piece_keys:
+        for c in mosaic.valid_pieces[e]:
+            stock = inventory.get(e, {}).get(c, 0)
+            assert summary[e][c] <= stock
+            assert summary['remaining stock'][e][c] == stock - summary[e][c]
+
+def test_substitutes_are_the_closest_colors_in_stock(tmp_path):
+    candidates = ['New Dark Red', 'Bright Orange', 'Bright Blue', 'Black']
+    inventory = {'1x1': dict({c: 12 for c in candidates}, **{'Bright Red': 10})}
+    mosaic = createCanvas((6, 5), tmp_path, inventory, merge_design_blocks=False)
+    color_idx = np.full((6, 5), mosaic.color_index['Bright Red'])
+    mosaic.addQuantizedDesign((0, 0), color_idx, np.ones(color_idx.shape, dtype=bool))
+
+    # 10 red pieces, then the closest color with stock is used up before the next one
+    counter = mosaic.pieces_counter['1x1']
+    closest = getClosestColors(mosaic, 'Bright Red', candidates)
+    assert counter['Bright Red'] == 10
+    assert [counter[c] for c in closest] == [12, 8, 0, 0]
+    assert (mosaic.anch_state == 1).all()
+
+def test_leftover_blocks_get_1x1_pieces(tmp_path):
+    # Only 2x4 red pieces, which don't fit in a line of one block, and 1x1 pieces of other colors
+    candidates = ['New Dark Red', 'Bright Blue']
+    inventory = {'2x4': {'Bright Red': 10}, '1x1': {c: 20 for c in candidates}}
+    mosaic = createCanvas((12, 1), tmp_path, inventory)
+    color_idx = np.full((12, 1), mosaic.color_index['Bright Red'])
+    mosaic.addQuantizedDesign((0, 0), color_idx, np.ones(color_idx.shape, dtype=bool))
+
+    counter = mosaic.pieces_counter
+    closest = getClosestColors(mosaic, 'Bright Red', candidates)
+    assert counter['2x4']['Bright Red'] == 0
+    assert counter['1x1'][closest[0]] == 12
+    assert (mosaic.anch_state == 1).all()
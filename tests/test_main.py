@@ -0,0 +1,15 @@
+import json
+import os
+
+from main import loadJobs
+
+def test_directory_jobs_skip_other_json_files(tmp_path, capsys):
+    # An inventory kept next to the jobs isn't a job
+    (tmp_path / 'wall.json').write_text(json.dumps({'canvas_config': {'inventory': 'inventory.json'}, 'designs': {}}))
+    (tmp_path / 'inventory.json').write_text(json.dumps({'2x4': {'Red': 10}}))
+
+    jobs = loadJobs(str(tmp_path))
+
+    assert [name for name, _, _ in jobs] == ['wall']
+    assert jobs[0][2] == str(tmp_path)
+    assert 'Skipping ' + os.path.join(str(tmp_path), 'inventory.json') in capsys.readouterr().out
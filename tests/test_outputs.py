@@ -0,0 +1,45 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from api import createCanvas, loadConfig, quantizeDesigns, updateDesigns
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='module')
+def mosaic():
+    config = loadConfig(os.path.join(ROOT, 'conf.json'))
+    canvas_data = dict(config['canvas_config'], output_formats=['svg', 'table', 'instructions'])
+    mosaic = createCanvas(canvas_data, base_dir=ROOT)
+    designs_data = {name: dict(design, path=os.path.join(ROOT, design['path'])) for name, design in config['designs'].items()}
+    updateDesigns(mosaic, designs_data, quantizeDesigns(mosaic, designs_data))
+    return mosaic
+
+@pytest.mark.parametrize('plate_size', [16, 32])
+def test_instructions_cover_every_stud(mosaic, tmp_path, plate_size):
+    mosaic.plate_size = plate_size
+    mosaic.save(str(tmp_path))
+    with open(os.path.join(str(tmp_path), 'instructions', 'instructions.json')) as infile:
+        instructions = json.load(infile)
+    assert any(len(plate['continued']) > 0 for plate in instructions['plates'])
+    total = {}
+    for plate in instructions['plates']:
+        width, height = plate['size']
+        coverage = np.zeros((width, height), dtype=np.int32)
+        for x, y, w, h, color in plate['pieces'] + plate['continued']:
+            coverage[max(x, 0):x+w, max(y, 0):y+h] += 1
+        assert (coverage == 1).all()
+        for key, colors in plate['bill'].items():
+            for color, count in colors.items():
+                total[(key, color)] = total.get((key, color), 0) + count
+    # The bills of the baseplates add up to the bill of materials of the canvas
+    counter = mosaic.pieces_counter
+    assert total == {(key, color): count for key in counter for color, count in counter[key].items() if count > 0}
+
+def test_placement_table(mosaic, tmp_path):
+    mosaic.save(str(tmp_path))
+    table = np.load(os.path.join(str(tmp_path), 'placements.npy'))
+    assert (table == mosaic.getPlacements()).all()
+    assert os.path.getsize(os.path.join(str(tmp_path), 'mosaic.svg')) > 0
@@ -0,0 +1,66 @@
+import base64
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import cv2
+import numpy as np
+import pytest
+
+from api import loadConfig
+from service import createServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='module')
+def server():
+    config = loadConfig(os.path.join(ROOT, 'conf.json'))
+    config['canvas_config'] = dict(config['canvas_config'], blocks_per_row=40, blocks_per_col=30)
+    server = createServer(config, port=0, base_dir=ROOT)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:' + str(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+def post(url, data):
+    body = data if isinstance(data, bytes) else json.dumps(data).encode()
+    request = urllib.request.Request(url + '/mosaic', body, {'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def getDesign(**options):
+    with open(os.path.join(ROOT, 'images', 'designs', 'pix_art_sample_1.png'), 'rb') as infile:
+        image = base64.b64encode(infile.read()).decode('ascii')
+    return dict({'image': image, 'position': [5, 5], 'size': [15, 12], 'keep white': False}, **options)
+
+def test_mosaic(server):
+    status, response = post(server, {'designs': [getDesign()]})
+    assert status == 200
+    assert response['pieces'] > 0
+    assert base64.b64decode(response['png']).startswith(b'\x89PNG')
+
+@pytest.mark.parametrize('options', [{'position': [35, 5]}, {'position': [-1, 5]}, {'position': [40, 0]}, 
+                                     {'position': 'a'}, {'size': [0, 12]}, {'size': [15]}, {'crop': [0, 0, 5000, 10]},
+                                     {'image': 'aGVsbG8='}, {'dithering': 'unknown'}])
+def test_invalid_design(server, options):
+    status, response = post(server, {'designs': [getDesign(**options)]})
+    assert status == 400
+    assert response['error']
+
+@pytest.mark.parametrize('data', [b'not json', [1, 2], {'designs': [1]}, {'designs': 'a'}])
+def test_invalid_request(server, data):
+    status, response = post(server, data)
+    assert status == 400
+    assert response['error']
+
+def test_one_pixel_design(server):
+    image = base64.b64encode(cv2.imencode('.png', np.full((1, 1, 3), 100, dtype=np.uint8))[1].tobytes()).decode('ascii')
+    status, response = post(server, {'designs': [{'image': image, 'position': [0, 0]}]})
+    assert status == 200
+    assert response['pieces'] > 0
@@ -0,0 +1,84 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from api import loadConfig
+from main import generateMosaic
+from render import PLACEMENT_H, PLACEMENT_W, PLACEMENT_X, PLACEMENT_Y
+from sharding import generateShardedMosaic, getShards
+from utils import colors_dictionary, getPieceSize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARD_SIZE = 32
+
+@pytest.fixture
+def config():
+    config = loadConfig(os.path.join(ROOT, 'conf.json'))
+    config['canvas_config'] = dict(config['canvas_config'], shard_size=SHARD_SIZE, output_formats=['png', 'table'])
+    for design in config['designs'].values():
+        design['path'] = os.path.join(ROOT, design['path'])
+    return config
+
+def loadResults(output_dir):
+    placements = np.load(os.path.join(output_dir, 'placements.npy'))
+    with open(os.path.join(output_dir, 'summary.json')) as infile:
+        summary = json.load(infile)
+    with open(os.path.join(output_dir, 'shards.json')) as infile:
+        index = json.load(infile)
+    return placements, summary, index
+
+def test_shards_merge_into_the_summary(config, tmp_path):
+    summary = generateShardedMosaic(config, str(tmp_path), ROOT)
+    placements, saved_summary, index = loadResults(str(tmp_path))
+    assert saved_summary == summary
+
+    # No piece crosses the boundary of a shard and every anchor is covered once
+    x0, y0 = placements[:, PLACEMENT_X], placements[:, PLACEMENT_Y]
+    x1, y1 = x0 + placements[:, PLACEMENT_W] - 1, y0 + placements[:, PLACEMENT_H] - 1
+    assert (x0 // SHARD_SIZE == x1 // SHARD_SIZE).all() and (y0 // SHARD_SIZE == y1 // SHARD_SIZE).all()
+    size = (config['canvas_config']['blocks_per_row'], config['canvas_config']['blocks_per_col'])
+    coverage = np.zeros(size, dtype=np.int32)
+    for x, y, w, h, _ in placements:
+        coverage[x:x+w, y:y+h] += 1
+    assert (coverage == 1).all()
+
+    # The bill of materials is the sum of the pieces of the shards
+    shards = getShards(size, SHARD_SIZE)
+    assert [shard['name'] for shard in index] == [name for name, _, _ in shards]
+    for shard, (name, origin, shard_dims) in zip(index, shards):
+        inside = ((x0 >= origin[0]) & (x0 < origin[0] + shard_dims[0]) & (y0 >= origin[1]) & (y0 < origin[1] + shard_dims[1]))
+        assert shard['pieces'] == inside.sum()
+        assert os.path.exists(os.path.join(str(tmp_path), 'shards', name + '.png'))
+    assert sum(shard['pieces'] for shard in index) == len(placements)
+    valid_pieces = config['canvas_config']['valid_pieces']
+    total = {}
+    for _, _, w, h, color in placements:
+        total[(w, h, int(color))] = total.get((w, h, int(color)), 0) + 1
+    color_names = list(colors_dictionary.keys())
+    for key in valid_pieces:
+        rows, cols = getPieceSize(key)
+        for color in valid_pieces[key]:
+            assert summary[key][color] == total.get((cols, rows, color_names.index(color)), 0)
+    assert sum(shard['price'] for shard in index) == pytest.approx(sum(
+        summary[key][color] * valid_pieces[key][color] for key in valid_pieces for color in valid_pieces[key]))
+
+def test_workers_keep_the_order_of_the_shards(config, tmp_path):
+    single_dir, multi_dir = str(tmp_path / 'single'), str(tmp_path / 'multi')
+    os.makedirs(single_dir)
+    os.makedirs(multi_dir)
+    generateShardedMosaic(config, single_dir, ROOT, workers=1)
+    generateShardedMosaic(config, multi_dir, ROOT, workers=2)
+    single, _, single_index = loadResults(single_dir)
+    multi, _, multi_index = loadResults(multi_dir)
+    # The fill uses random colors, only the pieces and their order are compared
+    columns = [PLACEMENT_X, PLACEMENT_Y, PLACEMENT_W, PLACEMENT_H]
+    assert (single[:, columns] == multi[:, columns]).all()
+    assert [(s['name'], s['pieces']) for s in single_index] == [(s['name'], s['pieces']) for s in multi_index]
+
+def test_profiling_warning(config, tmp_path, capsys):
+    config['canvas_config']['profile'] = True
+    assert generateMosaic(config, str(tmp_path), headless=True, base_dir=ROOT) is None
+    assert 'Profiling isn\'t supported for sharded mosaics' in capsys.readouterr().out
+    assert not os.path.exists(os.path.join(str(tmp_path), 'profile.json'))
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from tiling import PIECE_KEYS, getPieceSize, getPlacementsCost, tileMask, tileMaskOptimal
+
+def getCoverage(placements, shape):
+    coverage = np.zeros(shape, dtype=np.int32)
+    for key, xs, ys in placements:
+        rows, cols = getPieceSize(key)
+        for dx in range(cols):
+            for dy in range(rows):
+                np.add.at(coverage, (xs + dx, ys + dy), 1)
+    return coverage
+
+def getCosts(mode):
+    # Prices of conf.json: the bigger pieces are cheaper per stud
+    prices = {'2x4': 1.54, '2x3': 1.32, '2x2': 1.1, '1x4': 1.1, '1x3': 0.88, '1x2': 0.66, '1x1': 0.56}
+    if mode == 'price':
+        return prices
+    return {key: 1 + 1e-6 * price for key, price in prices.items()}
+
+@pytest.mark.parametrize('mode', ['price', 'count'])
+def test_optimal_never_worse_than_greedy(mode):
+    costs = getCosts(mode)
+    rng = np.random.RandomState(0)
+    for _ in range(100):
+        mask = rng.rand(rng.randint(1, 30), rng.randint(1, 30)) < rng.uniform(0.3, 1.0)
+        greedy = tileMask(mask.copy(), PIECE_KEYS)
+        free = mask.copy()
+        optimal = tileMaskOptimal(free, costs)
+        assert (getCoverage(optimal, mask.shape) == mask).all()
+        assert not free.any()
+        assert getPlacementsCost(optimal, costs) <= getPlacementsCost(greedy, costs) + 1e-9
+
+@pytest.mark.parametrize('start', [0, 1, 3])
+def test_optimal_two_row_strip(start):
+    mask = np.zeros((32, 8), dtype=bool)
+    mask[:, start:start+2] = True
+    optimal = tileMaskOptimal(mask.copy(), getCosts('count'))
+    assert sum(len(xs) for key, xs, ys in optimal) == 8
+
+def test_optimal_needs_1x1():
+    with pytest.raises(ValueError):
+        tileMaskOptimal(np.ones((4, 4), dtype=bool), {'2x2': 1.0})
@@ -0,0 +1,260 @@
+import numpy as np
+
+# List of all the possible sizes that can be used in the canvas, from the biggest to the smallest.
+# The order is important: the bigger pieces are placed first and the smaller ones fill the gaps.
+PIECE_KEYS = ['2x4','2x3','2x2','1x4','1x3','1x2','1x1']
+
+# Ways of filling the blank spaces of the canvas:
+#   greedy: the biggest pieces first, with random colors (see tileMask)
+#   price: minimum total price, using the cheapest color of each piece type (see tileMaskOptimal)
+#   count: minimum number of pieces, with random colors (see tileMaskOptimal)
+FILL_MODES = ('greedy', 'price', 'count')
+
+def getPieceSize(key):
+    """
+    Get the size of a piece from its key, e.g. '2x4' -> (2, 4).
+
+    Parameters
+    ----------
+    key: str
+        Piece type
+
+    Returns
+    ----------
+    tuple
+        Number of rows and columns for the piece
+    """
+    return (int(key[0]), int(key[2]))
+
+def getSummedAreaTable(mask):
+    """
+    Get the summed-area table of a mask: sat[x, y] is the number of True values in mask[:x, :y].
+
+    Parameters
+    ----------
+    mask: numpy.ndarray
+        Boolean matrix with shape (W, H)
+
+    Returns
+    ----------
+    numpy.ndarray
+        Matrix with shape (W+1, H+1)
+    """
+    sat = np.zeros((mask.shape[0]+1, mask.shape[1]+1), dtype=np.int32)
+    np.cumsum(np.cumsum(mask, axis=0, dtype=np.int32), axis=1, out=sat[1:, 1:])
+    return sat
+
+def getFits(mask, size):
+    """
+    Find all the positions where a piece fits, i.e. all the anchors covered by the piece are True in the mask.
+
+    Parameters
+    ----------
+    mask: numpy.ndarray
+        Boolean matrix with shape (W, H), True where the anchor is available
+    size: tuple
+        Number of rows and columns for the piece
+
+    Returns
+    ----------
+    numpy.ndarray
+        Boolean matrix with shape (W-cols+1, H-rows+1), True if the top-left corner of the piece can be placed there
+    """
+    w, h = size[1], size[0]
+    if mask.shape[0] < w or mask.shape[1] < h:
+        return np.zeros((max(mask.shape[0]-w+1, 0), max(mask.shape[1]-h+1, 0)), dtype=bool)
+    sat = getSummedAreaTable(mask)
+    area = sat[w:, h:] - sat[:-w, h:] - sat[w:, :-h] + sat[:-w, :-h]
+    return area == w*h
+
+def markPlacements(mask, xs, ys, size, value=False):
+    """
+    Set the anchors covered by a group of pieces of the same size.
+
+    Parameters
+    ----------
+    mask: numpy.ndarray
+        Matrix with shape (W, H)
+    xs, ys: numpy.ndarray
+        Positions of the top-left corner of the pieces
+    size: tuple
+        Number of rows and columns for the pieces
+    value:
+        Value assigned to the covered anchors
+    """
+    for dx in range(size[1]):
+        for dy in range(size[0]):
+            mask[xs+dx, ys+dy] = value
+
+def tileMask(mask, keys=PIECE_KEYS, limits=None):
+    """
+    Cover the available anchors of a mask with pieces. The pieces are placed in bulk: for each piece size,
+    the positions are split into lattices with the same period as the piece (one lattice per phase). Pieces
+    placed on the same lattice can't overlap, so all the positions of a lattice where the piece fits (found
+    with a summed-area table) are taken at once. The cost is linear on the number of anchors.
+
+    Parameters
+    ----------
+    mask: numpy.ndarray
+        Boolean matrix with shape (W, H), True where the anchor is available. It is updated in place.
+    keys: list
+        Piece types to be used, in order of preference
+    limits: dict
+        Maximum number of pieces of each type (e.g. the available stock). If None, there is no limit.
+
+    Returns
+    ----------
+    placements: list
+        List of (key, xs, ys) tuples with the top-left corner of the pieces placed for each piece type
+    """
+    placements = []
+    for key in keys:
+        size = getPieceSize(key)
+        w, h = size[1], size[0]
+        remaining = np.inf if limits is None else limits.get(key, 0)
+        for px in range(w):
+            for py in range(h):
+                if remaining <= 0:
+                    break
+                fits = getFits(mask, size)
+                xs, ys = np.nonzero(fits[px::w, py::h])
+                if len(xs) == 0:
+                    continue
+                if len(xs) > remaining:
+                    xs, ys = xs[:int(remaining)], ys[:int(remaining)]
+                remaining -= len(xs)
+                xs = xs*w + px
+                ys = ys*h + py
+                markPlacements(mask, xs, ys, size)
+                placements.append((key, xs, ys))
+    return placements
+
+def getPlacementsCost(placements, costs):
+    """
+    Get the total cost of a list of placements, see tileMask().
+    """
+    return sum(costs[key] * len(xs) for key, xs, ys in placements)
+
+def tileBands(mask, costs, phase=0):
+    """
+    Cover the available anchors of a mask with pieces, splitting the mask into bands of two rows starting at
+    row phase (the first band only has one row when phase is 1). Each band is solved exactly with dynamic 
+    programming along its columns: the state is the number of columns (0 to 3) already covered beyond the 
+    current one in each row, so the pieces of the two rows don't need to be aligned. All the bands are solved 
+    at the same time with vectorized operations, so the cost is linear on the number of anchors.
+
+    Parameters
+    ----------
+    mask: numpy.ndarray
+        Boolean matrix with shape (W, H), True where the anchor is available. It isn't modified.
+    costs: dict
+        Cost of each piece type that can be used, '1x1' is required so that every anchor can be covered
+    phase: int
+        Row where the first complete band starts (0 or 1)
+
+    Returns
+    ----------
+    placements: list
+        List of (key, xs, ys) tuples with the top-left corner of the pieces placed for each piece type
+    """
+    width, height = mask.shape
+    # Rows of each band (B, W): the mask is padded with blocked rows so the bands start at row phase
+    padded = np.zeros((width, phase + height + (phase + height) % 2), dtype=bool)
+    padded[:, phase:phase+height] = mask
+    rows = [padded[:, 0::2].T, padded[:, 1::2].T]
+    n_bands = rows[0].shape[0]
+    # Length of the run of free anchors starting at each column, up to the widest piece
+    runs = [np.zeros((n_bands, width + 1), dtype=np.int8) for _ in rows]
+    for x in range(width - 1, -1, -1):
+        for r in range(2):
+            runs[r][:, x] = np.minimum(runs[r][:, x+1] + 1, 4) * rows[r][:, x]
+
+    single = {w: costs['1x' + str(w)] for w in range(1, 5) if '1x' + str(w) in costs}
+    double = {w: costs['2x' + str(w)] for w in range(2, 5) if '2x' + str(w) in costs}
+
+    # best[s]: minimum cost of each band for the state s = 4*c0 + c1, where c0 and c1 are the columns covered
+    # beyond the current one in each row. The choice made at each column is encoded as 5*w0 + w1 for the 
+    # widths of the 1xN pieces starting in each row (0: none) or 25 + w for a 2xN piece.
+    best = np.full((16, n_bands), np.inf)
+    best[0] = 0
+    parent = np.zeros((width, 16, n_bands), dtype=np.int8)
+    action = np.zeros((width, 16, n_bands), dtype=np.int8)
+    for x in range(width):
+        new = np.full((16, n_bands), np.inf)
+        run = [r[:, x] for r in runs]
+        options = []
+        for r in range(2):
+            # A free anchor has to be covered, a blocked one is skipped
+            row_options = [(1, np.where(run[r] == 0, 0, np.inf), 0)]
+            row_options += [(w, np.where(run[r] >= w, cost, np.inf), w) for w, cost in single.items()]
+            options.append(row_options)
+        pair = np.minimum(run[0], run[1])
+        for s in range(16):
+            current = best[s]
+            if not np.isfinite(current).any():
+                continue
+            c0, c1 = divmod(s, 4)
+            choices = []
+            for n0, cost0, w0 in (options[0] if c0 == 0 else [(c0, 0, 0)]):
+                for n1, cost1, w1 in (options[1] if c1 == 0 else [(c1, 0, 0)]):
+                    choices.append((n0, n1, cost0 + cost1, 5*w0 + w1))
+            if c0 == 0 and c1 == 0:
+                choices += [(w, w, np.where(pair >= w, cost, np.inf), 25 + w) for w, cost in double.items()]
+            for n0, n1, cost, code in choices:
+                total = current + cost
+                state = 4*(n0 - 1) + (n1 - 1)
+                better = total < new[state]
+                new[state][better] = total[better]
+                parent[x, state][better] = s
+                action[x, state][better] = code
+        best = new
+
+    # Follow the choices of all the bands backwards, the pieces never go past the last column so every band 
+    # ends in the state 0
+    placed = {}
+    bands = np.arange(n_bands)
+    state = np.zeros(n_bands, dtype=np.int64)
+    for x in range(width - 1, -1, -1):
+        code = action[x, state, bands]
+        for value in np.unique(code[code > 0]):
+            group = bands[code == value]
+            if value > 25:
+                placed.setdefault('2x' + str(value - 25), []).append((np.full(len(group), x), 2*group - phase))
+                continue
+            for r, w in enumerate(divmod(value, 5)):
+                if w > 0:
+                    placed.setdefault('1x' + str(w), []).append((np.full(len(group), x), 2*group + r - phase))
+        state = parent[x, state, bands].astype(np.int64)
+
+    placements = []
+    for key, groups in placed.items():
+        placements.append((key, np.concatenate([g[0] for g in groups]), np.concatenate([g[1] for g in groups])))
+    return placements
+
+def tileMaskOptimal(mask, costs):
+    """
+    Cover the available anchors of a mask with pieces minimizing the total cost (e.g. the price or the number
+    of pieces). The mask is split into bands of two rows, with the two possible alignments of the bands, and
+    each band is solved exactly (see tileBands). The cheapest of both alignments and of the greedy tiling 
+    (see tileMask) is kept, so the result is never worse than the greedy one.
+
+    Parameters
+    ----------
+    mask: numpy.ndarray
+        Boolean matrix with shape (W, H), True where the anchor is available. It is updated in place.
+    costs: dict
+        Cost of each piece type that can be used, '1x1' is required so that every anchor can be covered
+
+    Returns
+    ----------
+    placements: list
+        List of (key, xs, ys) tuples with the top-left corner of the pieces placed for each piece type
+    """
+    if '1x1' not in costs:
+        raise ValueError('The optimal fill needs 1x1 pieces')
+    candidates = [tileBands(mask, costs, phase) for phase in range(min(2, mask.shape[1]))]
+    candidates.append(tileMask(mask.copy(), [key for key in PIECE_KEYS if key in costs]))
+    placements = min(candidates, key=lambda p: getPlacementsCost(p, costs))
+    for key, xs, ys in placements:
+        markPlacements(mask, xs, ys, getPieceSize(key))
+    return placements
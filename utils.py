@@ -1,7 +1,15 @@
+import copy
 import cv2
 import numpy as np
+import hashlib
 import json
-import random   
+import os
+
+from color_matching import (applyLookupTable, assignWithCapacity, convertColors, ditherBayer, ditherFloydSteinberg, 
+                            getColorDistances, loadLookupTable, paletteHash, DITHERING_MODES)
+from render import (renderPlacements, updatePlacementsPng, writeInstructions, writePlacementsPng, writePlacementsSvg, 
+                    writePlacementsTable, OUTPUT_FORMATS, PLACEMENT_X, PLACEMENT_Y, PLACEMENT_W, PLACEMENT_H, PLACEMENT_COLOR)
+from tiling import FILL_MODES, PIECE_KEYS, getPieceSize, markPlacements, tileMask, tileMaskOptimal
 
 # Conversion between the Lego color names and its RGB values as defined in: 
 # [http://ryanhowerter.net/colors.php]
@@ -33,216 +41,876 @@ colors_dictionary = {'White':[244,244,244],
                     'Medium Lavender':[160,110,185],
                     'Sand Yellow':[137,125,98],
                     'Bright Purple':[200,80,155],
-                    'Cool Yellow':[255,236,108]}
+                    'Cool Yellow':[255,236,108],
+                    'Spring Yellowish Green':[223,238,165]}
+
+def getForegroundMask(image, threshold=30):
+    """
+    Get the pixels that differ from the background of an image. The background color is the median color 
+    of the image border.
+
+    Returns
+    ----------
+    numpy.ndarray
+        Boolean matrix with shape (H, W), True for the pixels whose difference (max over the channels) with 
+        the background is bigger than the threshold
+    """
+    border = np.concatenate((image[0, :], image[-1, :], image[:, 0], image[:, -1]))
+    background = np.median(border, axis=0)
+    diff = cv2.absdiff(np.ascontiguousarray(image), np.full(image.shape, background, dtype=np.uint8))
+    return np.maximum(np.maximum(diff[..., 0], diff[..., 1]), diff[..., 2]) > threshold
+
+def getTransitionProfile(image, axis, threshold=30):
+    """
+    Get the fraction of color transitions at each boundary between consecutive columns (axis=1) or rows 
+    (axis=0) of an image.
+
+    Returns
+    ----------
+    numpy.ndarray
+        Fraction of the rows (or columns) with a transition at each boundary, profile[i] is the boundary 
+        before pixel i+1
+    """
+    image = np.ascontiguousarray(image)
+    if image.shape[axis] < 2:
+        # There are no boundaries between pixels along the axis
+        return np.zeros(0)
+    if axis == 1:
+        diff = cv2.absdiff(image[:, 1:], image[:, :-1])
+    else:
+        diff = cv2.absdiff(image[1:], image[:-1])
+    # Max over the channels without leaving uint8
+    transitions = np.maximum(np.maximum(diff[..., 0], diff[..., 1]), diff[..., 2]) > threshold
+    return np.count_nonzero(transitions, axis=1-axis) / transitions.shape[1-axis]
+
+def detectGridPitch(profile, length, min_fraction=0.02):
+    """
+    Detect the grid of a pixel art design along one axis from its transition profile. The boundaries between 
+    blocks are the positions with strong transitions (runs of consecutive boundaries due to anti-aliasing, 
+    compression or grid lines are merged). The distances between boundaries are multiples of the pitch: the 
+    smallest ones give a first estimate, which is refined with a least squares fit of all the boundaries.
+
+    Parameters
+    ----------
+    profile: numpy.ndarray
+        Transition profile, see getTransitionProfile()
+    length: int
+        Number of pixels along the axis
+    min_fraction: float
+        Minimum fraction of transitions for a position to be a boundary between blocks
+
+    Returns
+    ----------
+    pitch: float
+        Size of a block in pixels
+    offset: float
+        Position of the first boundary, in [0, pitch)
+    """
+    # Weak transitions (e.g. watermarks) are ignored
+    positions = np.nonzero(profile > max(min_fraction, 0.2 * profile.max(initial=0)))[0] + 1
+    if len(positions) == 0:
+        return float(length), 0.0
+    # Center of each run of consecutive boundaries
+    runs = np.split(positions, np.nonzero(np.diff(positions) > 1)[0] + 1)
+    centers = np.asarray([run.mean() for run in runs])
+    gaps = np.diff(np.concatenate(([0], centers, [length]))) if len(centers) < 2 else np.diff(centers)
+    # Gaps of one or two pixels are left by thin details (e.g. outlines), not by blocks
+    gaps = gaps[gaps > 2] if np.any(gaps > 2) else gaps
+    pitch = np.median(gaps[gaps < 1.5 * gaps.min()])
+
+    # Index of each boundary in the grid, then fit the pitch and the offset to all of them
+    steps = np.round((centers - centers[0]) / pitch)
+    if len(np.unique(steps)) > 1:
+        pitch, offset = np.polyfit(steps, centers, 1)
+    else:
+        offset = centers[0]
+    return float(pitch), float(offset % pitch)
+
+def detectDesignGrid(image, threshold=30, min_fraction=0.02):
+    """
+    Detect the blocks of a pixel art design without user interaction: the pitch of the grid is found from the 
+    color transitions between blocks (see detectGridPitch), then each cell of the grid is classified as design 
+    or background depending on how many of its pixels differ from the background. Grid lines, watermarks and 
+    partial cells at the border of the image are ignored, since they only cover a small part of the cells.
+
+    Parameters
+    ----------
+    image: numpy.ndarray
+        Image with the design
+    threshold: int
+        Minimum difference (max over the channels) between two pixels to be a color transition, and with 
+        the background for a pixel to be part of the design
+    min_fraction: float
+        Minimum fraction of transitions for a position to be a boundary between blocks
+
+    Returns
+    ----------
+    box: list
+        Region of the image with the cells of the design, [x_min, y_min, x_max, y_max] (same format as "crop")
+    size: tuple
+        Number of blocks per row and column of the design
+    """
+    height, width = image.shape[:2]
+    if height < 2 or width < 2:
+        # Too small to have a grid, the whole image is a single block
+        return [0, 0, width, height], (1, 1)
+    edges = []
+    for axis, length in [(1, width), (0, height)]:
+        pitch, offset = detectGridPitch(getTransitionProfile(image, axis, threshold), length, min_fraction)
+        lines = offset + np.arange(int(np.ceil(length / pitch)) + 1) * pitch
+        # Slivers of less than half a block at the border of the image are merged with the next cell, and the
+        # cells at the border are at most one block wide so they don't stretch over the margin of the image
+        lines = lines[(lines > pitch / 2) & (lines < length - pitch / 2)]
+        first, last = (max(0, lines[0] - pitch), min(length, lines[-1] + pitch)) if len(lines) > 0 else (0, length)
+        edges.append(np.round(np.concatenate(([first], lines, [last]))).astype(int))
+    x_edges, y_edges = edges
+
+    # Fraction of pixels of each cell that differ from the background, (rows, columns) matrix
+    mask = getForegroundMask(image, threshold)[y_edges[0]:y_edges[-1], x_edges[0]:x_edges[-1]]
+    x_edges, y_edges = x_edges - x_edges[0], y_edges - y_edges[0]
+    sums = np.add.reduceat(np.add.reduceat(mask.astype(np.int32), y_edges[:-1], axis=0), x_edges[:-1], axis=1)
+    fraction = sums / np.outer(np.diff(y_edges), np.diff(x_edges))
+    rows, cols = np.nonzero(fraction.max(axis=1) > 0.5)[0], np.nonzero(fraction.max(axis=0) > 0.5)[0]
+    if len(rows) == 0 or len(cols) == 0:
+        return [0, 0, width, height], (len(x_edges) - 1, len(y_edges) - 1)
+    x_start, y_start = edges[0][0], edges[1][0]
+    box = [int(x_edges[cols[0]] + x_start), int(y_edges[rows[0]] + y_start), int(x_edges[cols[-1]+1] + x_start), 
+           int(y_edges[rows[-1]+1] + y_start)]
+    return box, (int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1))
+
+def getDesignGrid(image, design_data):
+    """
+    Get the region and the size of a design without user interaction. With both a crop box and a size in the 
+    configuration ("crop" and "size"), they are used as they are. Otherwise the blocks of the design are detected
+    inside the crop box, or the whole image if there is no crop box (see detectDesignGrid). If the configured 
+    size doesn't match the blocks detected, a warning is shown and the whole image is used with that size.
+
+    Parameters
+    ----------
+    image: numpy.ndarray
+        Image with the design
+    design_data: dict
+        Configuration of the design
+
+    Returns
+    ----------
+    roi: numpy.ndarray
+        Region of the image containing the design
+    size: tuple
+        Number of blocks per row and column of the design
+    """
+    if design_data.get('size') is not None and 'crop' in design_data:
+        x_min, y_min, x_max, y_max = design_data['crop']
+        return image[y_min:y_max, x_min:x_max], tuple(design_data['size'])
+    (x_min, y_min, x_max, y_max), size = detectDesignBox(image, design_data)
+    if design_data.get('size') is not None and tuple(design_data['size']) != size:
+        # The detected box can't be trusted (e.g. a full-bleed design whose outer blocks have the color of the 
+        # border are taken as background), so the configured size is sampled over the whole image
+        print('WARNING: Detected ' + str(size[0]) + 'x' + str(size[1]) + ' blocks in the design but its size is ' 
+              + str(design_data['size'][0]) + 'x' + str(design_data['size'][1]) + ', the whole image is used. '
+              'Set its "crop" if the design doesn\'t cover the image')
+        return image, tuple(design_data['size'])
+    return image[y_min:y_max, x_min:x_max], size
+
+def detectDesignBox(image, design_data):
+    """
+    Detect the blocks of a design inside its crop box, or the whole image if there is no crop box.
+
+    Returns
+    ----------
+    box: list
+        Region of the image with the cells of the design, [x_min, y_min, x_max, y_max] (same format as "crop")
+    size: tuple
+        Number of blocks per row and column of the design
+    """
+    x_offset, y_offset = 0, 0
+    if 'crop' in design_data:
+        x_offset, y_offset, x_max, y_max = design_data['crop']
+        image = image[y_offset:y_max, x_offset:x_max]
+    box, size = detectDesignGrid(image)
+    return [box[0] + x_offset, box[1] + y_offset, box[2] + x_offset, box[3] + y_offset], size
+
+def getDesignAnchors(shape, size):
+    """
+    Get the pixel positions of the anchor points of a design: one anchor in the center of each block.
+            
+    Parameters
+    ----------
+    shape: tuple
+        Shape of the image with the design
+    size: tuple
+        Number of blocks per row and column of the design
+
+    Returns
+    ----------
+    anch_x, anch_y: numpy.ndarray
+        x and y positions of the anchor points
+    """
+    [height, width] = shape[:2]
+    # Get the position increments between each anchor point
+    inc_x = width/size[0]
+    inc_y = height/size[1]
+    anch_x = ((np.arange(size[0]) + 0.5) * inc_x).astype(int)
+    anch_y = ((np.arange(size[1]) + 0.5) * inc_y).astype(int)
+    return anch_x, anch_y
+
+def sampleDesign(image, size, sampling='center'):
+    """
+    Extract the color of each block of a pixel art design.
+            
+    Parameters
+    ----------
+    image: numpy.ndarray
+        image with the design
+    size: tuple
+        Number of blocks per row and column of the design
+    sampling: str
+        How the color of each block is extracted:
+            'center': color of the pixel at the anchor point (center of the block)
+            'mean': mean color of the block
+            'median': median color of the block, robust to noise and compression artifacts (e.g. JPEG designs)
+
+    Returns
+    ----------
+    design: numpy.ndarray
+        Matrix with the colors for each block of the design
+    """
+    [height, width, _] = image.shape
+    if sampling == 'center':
+        # Get the color of the pixel at each anchor point with a single gather, (W, H, 3) matrix
+        anch_x, anch_y = getDesignAnchors(image.shape, size)
+        return image[anch_y[np.newaxis, :], anch_x[:, np.newaxis], :].astype(np.float64)
+    elif sampling == 'mean':
+        # Area interpolation averages all the pixels that fall into each block
+        return cv2.resize(image, (size[0], size[1]), interpolation=cv2.INTER_AREA).transpose(1, 0, 2).astype(np.float64)
+    elif sampling == 'median':
+        # Resample the image so that every block has the same number of pixels (k x k) and reduce each block
+        k = max(1, int(min(width/size[0], height/size[1])))
+        resized = cv2.resize(image, (size[0]*k, size[1]*k), interpolation=cv2.INTER_NEAREST)
+        blocks = resized.reshape(size[1], k, size[0], k, 3)
+        return np.median(blocks, axis=(1, 3)).transpose(1, 0, 2)
+    raise ValueError('Unknown sampling mode: ' + str(sampling) + '. Valid values: center, mean, median')
+
+def quantizeDesign(design, lut, keep_white, dithering='none', color_table=None):
+    """
+    Get the closest Lego color for all the blocks of a design with a lookup table.
+            
+    Parameters
+    ----------
+    design: numpy.ndarray
+        Matrix with the colors (BGR) for each block of the design
+    lut: numpy.ndarray
+        Lookup table from RGB values to indexes in colors_dictionary (see color_matching.buildLookupTable)
+    keep_white: bool
+        Define if the white bricks count as part of the design or only the background.
+    dithering: str
+        One of color_matching.DITHERING_MODES, dithering gives smoother results for photos
+    color_table: numpy.ndarray
+        RGB values of the colors of colors_dictionary, needed for dithering
+
+    Returns
+    ----------
+    color_idx: numpy.ndarray
+        Index in colors_dictionary of the color of each block
+    used: numpy.ndarray
+        Boolean matrix, True for the blocks that are part of the design
+    """
+    # The design is stored in BGR, the palettes in RGB
+    design_rgb = np.asarray(design)[:, :, ::-1]
+    if keep_white is False:
+        used = ~np.all(design_rgb >= 250, axis=2)
+    else:
+        used = np.ones(design_rgb.shape[:2], dtype=bool)
+    if dithering == 'none':
+        return applyLookupTable(lut, design_rgb), used
+    elif dithering == 'floyd-steinberg':
+        return ditherFloydSteinberg(design_rgb, lut, color_table), used
+    elif dithering == 'bayer':
+        return ditherBayer(design_rgb, lut, color_table), used
+    raise ValueError('Unknown dithering mode: ' + str(dithering) + '. Valid values: ' + ', '.join(DITHERING_MODES))
+
+# Version of the parsing of the designs, changing it invalidates the designs in the cache
+DESIGN_CACHE_VERSION = '4'
+
+def getDesignKey(path, design_data, palette_key):
+    """
+    Get the key of a quantized design in the cache. The key is computed from the content of the image, so
+    it changes when the file is modified and not when it is moved or touched.
+
+    Parameters
+    ----------
+    path: str
+        Path of the design image
+    design_data: dict
+        Configuration of the design, only the options that change the result are used (crop, size, sampling, 
+        dithering and keep white)
+    palette_key: str
+        Key of the palette used to quantize the design, see canvas.getPaletteKey()
+
+    Returns
+    ----------
+    str
+        Key of the design
+    """
+    h = hashlib.sha1(DESIGN_CACHE_VERSION.encode())
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            h.update(block)
+    options = {k: design_data.get(k) for k in ('crop', 'size', 'sampling', 'dithering', 'keep white')}
+    h.update(json.dumps(options, sort_keys=True).encode())
+    h.update(palette_key.encode())
+    return h.hexdigest()[:16]
 
 class canvas(object):
-    def  __init__(self, size: tuple, valid_pieces):
+    def  __init__(self, size: tuple, valid_pieces, headless=False, lut_bits=6, color_metric='rgb', cache_dir='./.cache',
+                  fill_mode='greedy', merge_design_blocks=True, inventory=None, output_formats=('png',), plate_size=32):
         # Calculate the size of the canvas based on the number of blocks per column/row
         piece_size = 30 # size of the piece in pixels        
-        canvas_width = piece_size * (size[0]+1)
-        canvas_height = piece_size * (size[1]+1)
 
-        # Initialize the canvas
-        self.img = np.zeros((canvas_height, canvas_width,3), np.uint8)
-        self.img[:,:, :] = [200, 255, 255]
-        self.clone = self.img.copy()
-        
-        # Initialize container to save the anchor points for the canvas. 
-        self.anch_pos = np.zeros(shape=(size[0], size[1], 2))
-        self.anch_state = np.zeros(shape=(size[0], size[1]))
-
-        # Define the x and y positions of the anchor points 
-        anch_x = np.arange(piece_size/2, canvas_width, piece_size)
-        anch_y = np.arange(piece_size/2, canvas_height, piece_size)
-        for _x in range(size[0]):
-            for _y in range(size[1]):
-                self.anch_pos[_x, _y] = np.asarray([anch_x[_x], anch_y[_y]])
-                cv2.circle(self.img, (int(anch_x[_x]),int(anch_y[_y])), 1, (0,0,255), -1) 
-        
-        # In order to keep track of the amount of each different pieces, we will create a nested dictionary. 
-        # The first level covers the different types of pieces and the second level covers the different colors for each piece
-        self.pieces_counter  = dict.fromkeys(valid_pieces)
-        for e in self.pieces_counter:    
-            valid_colors  = dict.fromkeys(valid_pieces[e])      
-            for c in valid_colors: 
-                valid_colors.update({c:0}) 
-            self.pieces_counter.update({e: valid_colors})
+        # The pieces aren't drawn when they are placed. Each piece is stored as a (x, y, w, h, color_index) record 
+        # and the image of the canvas is rendered in one pass when needed (see render()).
+        self.placements = np.zeros((1024, 5), dtype=np.int32)
+        self.num_placements = 0
         
+        # State of the anchor points: 1 if the anchor is covered by a piece, and the index in the placements of the piece 
+        # covering it (-1 if free). The pixel positions of the anchors are computed when needed (see anch_pos).
+        self.anch_state = np.zeros(size, dtype=np.uint8)
+        self.owner = np.full(size, -1, dtype=np.int32)
+
+        # Colors are referred by their index in colors_dictionary: color_names[i] is the Lego color name of color_table[i]
+        self.color_names = np.asarray(list(colors_dictionary.keys()))
+        self.color_table = np.asarray(list(colors_dictionary.values()), dtype=np.float32)
+
+        # Store the palette of each type of piece as an array, so the color matching can be done for many colors at once.
+        # palette_idx[e][i] is the index in colors_dictionary of the RGB value palettes[e][i]
+        self.color_index = {c: i for i, c in enumerate(self.color_names)}
+        self.palette_idx = {}
+        self.palettes = {}
+        for e in valid_pieces:
+            self.palette_idx[e] = np.asarray([self.color_index[c] for c in valid_pieces[e]], dtype=np.int64)
+            self.palettes[e] = self.color_table[self.palette_idx[e]]
+
+        # In order to keep track of the amount of each different pieces, we use a (piece type x color) matrix of counters, 
+        # with a matching matrix of prices. Rows follow piece_keys and columns follow colors_dictionary.
+        self.piece_keys = list(valid_pieces.keys())
+        self.piece_index = {e: i for i, e in enumerate(self.piece_keys)}
+        self.counts = np.zeros((len(self.piece_keys), len(self.color_names)), dtype=np.int64)
+        self.prices = np.zeros(self.counts.shape)
+        for e in valid_pieces:
+            self.prices[self.piece_index[e], self.palette_idx[e]] = list(valid_pieces[e].values())
+
+        # The palettes are converted once to the color space of the metric used for matching (RGB or CIELAB)
+        self.color_metric = color_metric
+        self.matching_palettes = {e: convertColors(self.palettes[e], color_metric) for e in valid_pieces}
+
+        # RGB to color lookup tables, loaded the first time each piece type is matched (see getLookupTable)
+        self.lut_bits = lut_bits
+        self.cache_dir = cache_dir
+        self.luts = {}
+
+        # Way of filling the blank spaces (see tiling.FILL_MODES). With an optimizing mode, the price and number of 
+        # pieces saved with respect to the greedy fill are accumulated to be reported by save()
+        if fill_mode not in FILL_MODES:
+            raise ValueError('Unknown fill mode: ' + str(fill_mode) + '. Valid values: ' + ', '.join(FILL_MODES))
+        self.fill_mode = fill_mode
+        self.fill_savings = {'price': 0.0, 'pieces': 0}
+        # Cover the regions of the designs with the same color with bigger pieces instead of 1x1 pieces
+        self.merge_design_blocks = merge_design_blocks
+
+        # Available stock with the same format as valid_pieces but with the number of pieces instead of the price.
+        # It is stored as a (piece type x color) matrix like the counters and decremented as the pieces are placed. 
+        # If None, there is no limit.
+        self.stock = None
+        if inventory is not None:
+            self.stock = np.zeros(self.counts.shape, dtype=np.int64)
+            for e in inventory:
+                for c in inventory[e]:
+                    if e not in valid_pieces or c not in valid_pieces[e]:
+                        print('WARNING: Ignoring stock of ' + e + ' ' + c + ', it isn\'t a valid piece')
+                        continue
+                    self.stock[self.piece_index[e], self.color_index[c]] = inventory[e][c]
+
+        # Files written by save() (see render.OUTPUT_FORMATS) and size of the baseplates of the instructions
+        for output_format in output_formats:
+            if output_format not in OUTPUT_FORMATS:
+                raise ValueError('Unknown output format: ' + str(output_format) + '. Valid values: ' + ', '.join(OUTPUT_FORMATS))
+        self.output_formats = tuple(output_formats)
+        self.plate_size = plate_size
+
+        # Anchors that changed since the canvas image was last saved, so only those regions are rendered again. 
+        # If None, the whole canvas is considered changed.
+        self.dirty = None
+
         # Save global variables for later use
         self.valid_pieces = valid_pieces
         self.size = size
         self.piece_size = piece_size
+        # When running without a display (e.g. batch mode), all the visualization calls are skipped
+        self.headless = headless
+
+    @property
+    def pieces_counter(self):
+        """
+        Number of pieces used as a nested dictionary: the first level covers the different types of pieces and the 
+        second level covers the different colors for each piece (same format as summary.json).
+        """
+        return {e: {c: int(self.counts[self.piece_index[e], self.color_index[c]]) for c in self.valid_pieces[e]} 
+                for e in self.piece_keys}
 
-    def incrementCounter(self, key, color_key):
+    @property
+    def remaining_stock(self):
         """
-        Increment the counter for a specific piece and color. This keeps track of how many pieces have been used in the canvas.
+        Number of pieces left in the stock, with the same format as pieces_counter. None if there is no inventory.
+        """
+        if self.stock is None:
+            return None
+        return {e: {c: int(self.stock[self.piece_index[e], self.color_index[c]]) for c in self.valid_pieces[e]} 
+                for e in self.piece_keys}
+
+    def getTotalPrice(self):
+        """
+        Get the price of all the pieces used in the canvas.
+
+        Returns
+        ----------
+        float
+            Total price
+        """
+        return float(np.vdot(self.counts, self.prices))
+
+    @property
+    def anch_pos(self):
+        """
+        Pixel positions of the anchor points in the image of the canvas, as a (W, H, 2) matrix with the x and y 
+        coordinates. One anchor in the center of each block.
+        """
+        anch_x = (np.arange(self.size[0]) + 0.5) * self.piece_size
+        anch_y = (np.arange(self.size[1]) + 0.5) * self.piece_size
+        return np.stack(np.meshgrid(anch_x, anch_y, indexing='ij'), axis=-1)
+
+    def addPlacements(self, records):
+        """
+        Append placement records to the canvas and mark the anchors covered by them.
                 
         Parameters
         ----------
-        key: str
-            Type of piece
-        color_key: str
-            Color of the piece
-        """         
-        value = self.pieces_counter[key][color_key]
-        value += 1
-        self.pieces_counter[key].update({color_key: value})
+        records: numpy.ndarray
+            Records with shape (N, 5): anchor position of the top-left corner, number of columns and rows of 
+            the piece and index of its color in colors_dictionary
+        """
+        records = np.asarray(records, dtype=np.int32)
+        ids = np.arange(self.num_placements, self.num_placements + len(records), dtype=np.int32)
+        # Pieces with the same size are marked together, one offset inside the piece at a time
+        w, h = records[:, PLACEMENT_W], records[:, PLACEMENT_H]
+        for piece_w, piece_h in set(zip(w.tolist(), h.tolist())):
+            group = (w == piece_w) & (h == piece_h)
+            xs, ys = records[group, PLACEMENT_X], records[group, PLACEMENT_Y]
+            markPlacements(self.owner, xs, ys, (piece_h, piece_w), ids[group])
+            markPlacements(self.anch_state, xs, ys, (piece_h, piece_w), 1)
+            if self.dirty is not None:
+                markPlacements(self.dirty, xs, ys, (piece_h, piece_w), True)
+
+        end = self.num_placements + len(records)
+        # Grow the container geometrically, so appending is cheap on average
+        if end > len(self.placements):
+            grown = np.zeros((max(end, 2*len(self.placements)), 5), dtype=np.int32)
+            grown[:self.num_placements] = self.placements[:self.num_placements]
+            self.placements = grown
+        self.placements[self.num_placements:end] = records
+        self.num_placements = end
 
-    def addPieceToCanvas(self, pos, size, color):
+    def getPlacements(self):
         """
-        Draw a new piece in the canvas.
-                
+        Get the placement records of all the pieces in the canvas.
+
+        Returns
+        ----------
+        numpy.ndarray
+            Records with shape (N, 5), see render.PLACEMENT_X...PLACEMENT_COLOR
+        """
+        return self.placements[:self.num_placements]
+
+    def render(self, piece_size=None):
+        """
+        Render the image of the canvas from the placement records.
+
         Parameters
         ----------
-        pos: tuple
-            Anchor position for the top-left corner of the piece.
-        size: tuple
-            Number of rows and columns for the piece
-        color: tuple
-            Color of the piece
+        piece_size: int
+            Size of a piece (one stud) in pixels, by default the one of the canvas
+
+        Returns
+        ----------
+        numpy.ndarray
+            BGR image of the canvas
         """
-        # Define the two diagonal corners of the piece
-        corner1 = np.asarray(self.anch_pos[pos[0], pos[1]])
-        corner1 = (int(corner1[0]), int(corner1[1]))
-        corner2 = np.asarray([corner1[0] + (self.piece_size*size[1]), corner1[1] + (self.piece_size*size[0])])
-        corner2 = (int(corner2[0]), int(corner2[1]))              
-        # Draw piece in the image  
-        cv2.rectangle(self.img, corner1, corner2, color, -1)
-        cv2.rectangle(self.img, corner1, corner2, (0,0,0), 1)
+        if piece_size is None:
+            piece_size = self.piece_size
+        return renderPlacements(self.getPlacements(), self.size, piece_size, self.color_table, self.owner)
 
-    def checkIfFits(self, pos, size, max_pos):
+    def placePieces(self, key, xs, ys, color_idx=None):
         """
-        Check if a new piece of the specified size would fit in the canvas.
+        Add a group of pieces of the same type to the canvas at once.
                 
+        Parameters
+        ----------
+        key: str
+            Type of piece
+        xs, ys: numpy.ndarray
+            Anchor positions for the top-left corner of the pieces
+        color_idx: numpy.ndarray
+            Index in colors_dictionary of the color of each piece. If None, a random color is chosen among the valid ones.
+        """
+        size = getPieceSize(key)
+        if color_idx is None:
+            palette_idx = self.palette_idx[key]
+            color_idx = palette_idx[np.random.randint(len(palette_idx), size=len(xs))]
+
+        # Add the pieces to the canvas, this updates the anchors state
+        records = np.empty((len(xs), 5), dtype=np.int32)
+        records[:, 0], records[:, 1] = xs, ys
+        records[:, 2], records[:, 3] = size[1], size[0]
+        records[:, 4] = color_idx
+        self.addPlacements(records)
+        # Update the counters of all the pieces at once
+        np.add.at(self.counts[self.piece_index[key]], color_idx, 1)
+        if self.stock is not None:
+            np.subtract.at(self.stock[self.piece_index[key]], color_idx, 1)
+
+    def clearRegion(self, pos, size):
+        """
+        Remove all the pieces that overlap a region of the canvas. The counters (and the stock) are updated with 
+        the removed pieces and their anchors are marked as free and changed.
+
         Parameters
         ----------
         pos: tuple
-            Position of the top-left corner of the piece.
+            Position of the top-left corner of the region
         size: tuple
-            Number of rows and columns for the piece
-        max_pos: tuple
-            Maximum position that can be reached by the piece
+            Number of anchors per row and column of the region
 
         Returns
         ----------
-        bool
-            True if the piece fits, False otherwise
+        tuple
+            (pos, size) of the bounding box of the anchors released, it can be bigger than the region since the 
+            pieces may stick out. None if no piece was removed.
         """
-        if (pos[0] + size[1]) <= (max_pos[0]) and (pos[1] + size[0]) <= (max_pos[1]):
-            for _r in range(size[0]):
-                for _c in range(size[1]):
-                    if self.anch_state[pos[0] + _c, pos[1] + _r] == 1:
-                        return False
-            return True
+        placements = self.getPlacements()
+        xs, ys = placements[:, PLACEMENT_X], placements[:, PLACEMENT_Y]
+        ws, hs = placements[:, PLACEMENT_W], placements[:, PLACEMENT_H]
+        overlap = ((xs < pos[0] + size[0]) & (xs + ws > pos[0]) & (ys < pos[1] + size[1]) & (ys + hs > pos[1]))
+        if not overlap.any():
+            return None
+        removed = placements[overlap]
+
+        # Update the anchors and the counters of each piece type at once
+        if self.dirty is None:
+            self.dirty = np.zeros(self.size, dtype=bool)
+        for e in self.piece_keys:
+            rows, cols = getPieceSize(e)
+            group = removed[(removed[:, PLACEMENT_W] == cols) & (removed[:, PLACEMENT_H] == rows)]
+            if len(group) == 0:
+                continue
+            markPlacements(self.anch_state, group[:, PLACEMENT_X], group[:, PLACEMENT_Y], (rows, cols), 0)
+            markPlacements(self.dirty, group[:, PLACEMENT_X], group[:, PLACEMENT_Y], (rows, cols), True)
+            np.subtract.at(self.counts[self.piece_index[e]], group[:, PLACEMENT_COLOR], 1)
+            if self.stock is not None:
+                np.add.at(self.stock[self.piece_index[e]], group[:, PLACEMENT_COLOR], 1)
 
-    def getPieceColor(self, key):
+        kept = placements[~overlap]
+        self.placements[:len(kept)] = kept
+        self.num_placements = len(kept)
+        # The pieces after the removed ones are shifted in the placements, update their index
+        new_ids = np.cumsum(~overlap, dtype=np.int32) - 1
+        covered = self.owner >= 0
+        self.owner[covered] = np.where(overlap[self.owner[covered]], -1, new_ids[self.owner[covered]])
+        x0, y0 = removed[:, PLACEMENT_X].min(), removed[:, PLACEMENT_Y].min()
+        x1 = (removed[:, PLACEMENT_X] + removed[:, PLACEMENT_W]).max()
+        y1 = (removed[:, PLACEMENT_Y] + removed[:, PLACEMENT_H]).max()
+        return (int(x0), int(y0)), (int(x1 - x0), int(y1 - y0))
+
+    def getStockColors(self, key, n):
         """
-        Get a random color among the possible values.
-                
+        Get colors for pieces of a type among the ones left in the stock: the cheapest ones with the price fill 
+        mode and random ones otherwise.
+
         Parameters
         ----------
         key: str
-            Piece type
+            Type of piece
+        n: int
+            Number of pieces, it can't be bigger than the stock of the piece type
 
         Returns
         ----------
-        color: tuple
-            RGB color code
-        color_key: str
-            Lego color value
-        """              
-        color_key = random.choice(list(self.pieces_counter[key].keys()))
-        color = colors_dictionary[color_key] 
-        color = (color[2], color[1], color[0])
-        return color, color_key   
+        numpy.ndarray
+            Index in colors_dictionary of the color of each piece
+        """
+        palette_idx = self.palette_idx[key]
+        row = self.piece_index[key]
+        if self.fill_mode == 'price':
+            palette_idx = palette_idx[np.argsort(self.prices[row, palette_idx], kind='stable')]
+            return np.repeat(palette_idx, self.stock[row, palette_idx])[:n]
+        pool = np.repeat(palette_idx, self.stock[row, palette_idx])
+        return np.random.choice(pool, n, replace=False)
+
+    def fill(self):
+        """
+        Fill all the blank spaces of the canvas with pieces.
+        """
+        self.fillSection((0, 0), self.size)
 
-    def addPiece(self, pos, max_pos):
+    def fillSection(self, pos, size):
         """
-        Find the piece that fits at a given position of the canvas
-                
+        Fill all the blank spaces of the section with pieces. All the placements of each piece type are found 
+        in bulk over the free anchors of the section, either greedily (see tiling.tileMask) or minimizing the
+        price or the number of pieces depending on the fill mode (see tiling.tileMaskOptimal).
+
         Parameters
         ----------
         pos: tuple
-            Position of the top-left corner of the piece.
-        max_pos: tuple
-            Maximum position that can be reached by the piece
-        
+            Position of the top-left corner of the section
+        size: tuple
+            Number of anchors per row and column of the section
+        """
+        section = (slice(pos[0], pos[0]+size[0]), slice(pos[1], pos[1]+size[1]))
+        free = self.anch_state[section] == 0
+        keys = [key for key in PIECE_KEYS if key in self.valid_pieces]
+        if self.stock is not None:
+            # The number of pieces of each type is limited by the stock, the anchors that can't be covered are left free
+            limits = {key: self.stock[self.piece_index[key]].sum() for key in keys}
+            for key, xs, ys in tileMask(free, keys, limits):
+                self.placePieces(key, xs + pos[0], ys + pos[1], self.getStockColors(key, len(xs)))
+            return
+        if self.fill_mode == 'greedy':
+            for key, xs, ys in tileMask(free, keys):
+                self.placePieces(key, xs + pos[0], ys + pos[1])
+            return
+
+        # The greedy fill of the same anchors is the reference for the savings, with the average price of its random colors
+        greedy = tileMask(free.copy(), keys)
+        greedy_price = sum(len(xs) * np.mean(list(self.valid_pieces[key].values())) for key, xs, ys in greedy)
+        greedy_pieces = sum(len(xs) for key, xs, ys in greedy)
+
+        price_before = self.getTotalPrice()
+        placements = tileMaskOptimal(free, self.getPieceCosts(keys))
+        for key, xs, ys in placements:
+            color_idx = None
+            if self.fill_mode == 'price':
+                # Random color among the cheapest ones of the piece type
+                prices = self.prices[self.piece_index[key], self.palette_idx[key]]
+                cheapest = self.palette_idx[key][prices == prices.min()]
+                color_idx = cheapest[np.random.randint(len(cheapest), size=len(xs))]
+            self.placePieces(key, xs + pos[0], ys + pos[1], color_idx)
+        self.fill_savings['price'] += float(greedy_price - (self.getTotalPrice() - price_before))
+        self.fill_savings['pieces'] += int(greedy_pieces - sum(len(xs) for key, xs, ys in placements))
+
+    def getPieceCosts(self, keys, color=None):
+        """
+        Get the cost of each piece type minimized by the fill mode. Ties are broken by the other objective: 
+        the cheapest option among the ones with fewer pieces and vice versa.
+
+        Parameters
+        ----------
+        keys: list
+            Piece types to be used
+        color: int
+            Index in colors_dictionary of the color of the pieces. If None, any color of the piece type can be used.
+
         Returns
         ----------
-        bool
-            True if the piece was found, False otherwise
+        dict
+            Cost of each piece type
         """
-        # List of all the possible sizes that can be used in the canvas. 
-        # The order is important, whenever a piece fits, the search will stop. 
-        possible_keys = ['2x4','2x3','2x2','1x4','1x3','1x2','1x1']
-        
-        for key in possible_keys: 
-            if key in self.pieces_counter.keys():
-                size = (int(key[0]), int(key[2]))
-                if self.checkIfFits(pos, size, max_pos):
-                    # Update the anchors state: 1 means that the anchor is being used
-                    self.anch_state[pos[0]:(pos[0]+size[1]), pos[1]:(pos[1]+size[0])] = 1 
-                    # Get the piece color
-                    piece_color, color_key = self.getPieceColor(key) 
-                    # Add the piece to the visualization of the canvas and update counter       
-                    self.addPieceToCanvas(pos, size, piece_color) 
-                    self.incrementCounter(key, color_key) 
-                    return True
-        return False
-  
-    def fill(self):
+        costs = {}
+        for key in keys:
+            price = self.prices[self.piece_index[key], self.palette_idx[key] if color is None else [color]]
+            if self.fill_mode == 'price':
+                costs[key] = price.min() + 1e-6
+            else:
+                costs[key] = 1 + 1e-6 * price.mean()
+        return costs
+
+    def getSummary(self):
         """
-        Fill all the blank spaces of the canvas with pieces.
+        Get the bill of materials of the canvas: number of pieces of each type and color and, if there is a 
+        stock, the pieces left in it.
+
+        Returns
+        ----------
+        dict
+            Same format as summary.json
         """
-        # Loop through all the anchors in the canvas
-        for _x in range(self.size[0]):
-            for _y in range(self.size[1]):
-                # If the anchor is free, find a piece that fits on the available space
-                if self.anch_state[_x,_y] == 0:
-                    self.addPiece((_x,_y), self.size)
+        summary = self.pieces_counter
+        if self.stock is not None:
+            summary['remaining stock'] = self.remaining_stock
+        return summary
 
-    def fillSection(self, pos, size):
+    def writePng(self, path):
         """
-        Fill all the blank spaces of the section with pieces.
+        Render the canvas and write it as a PNG image.
+
+        Parameters
+        ----------
+        path: str
+            Path of the PNG file, or binary file object where it is written
         """
-        # Loop through all the anchors in the canvas
-        for _x in range(size[0]):
-            for _y in range(size[1]):
-                # If the anchor is free, find a piece that fits on the available space
-                if self.anch_state[pos[0]+_x, pos[1]+_y] == 0:
-                    self.addPiece((pos[0]+_x, pos[1]+_y), (pos[0]+size[0], pos[1]+size[1]))
+        writePlacementsPng(path, self.getPlacements(), self.size, self.piece_size, self.color_table, owner=self.owner)
 
-    def save(self):
+    def emptyCopy(self, size=None):
+        """
+        Get an empty canvas with the same configuration. The palettes, prices and lookup tables are shared 
+        with this canvas, so the copy is cheap to create, while the pieces and the stock are its own.
+
+        Parameters
+        ----------
+        size: tuple
+            Number of anchors per row and column of the copy, the same as this canvas if None
+
+        Returns
+        ----------
+        canvas
+            Canvas without any piece, with the stock this canvas had before placing its pieces
+        """
+        empty = copy.copy(self)
+        empty.size = tuple(self.size if size is None else size)
+        empty.placements = np.zeros((1024, 5), dtype=np.int32)
+        empty.num_placements = 0
+        empty.anch_state = np.zeros(empty.size, dtype=np.uint8)
+        empty.owner = np.full(empty.size, -1, dtype=np.int32)
+        empty.counts = np.zeros(self.counts.shape, dtype=np.int64)
+        if self.stock is not None:
+            empty.stock = self.stock + self.counts
+        empty.fill_savings = {'price': 0.0, 'pieces': 0}
+        empty.dirty = None
+        return empty
+
+    def save(self, output_dir='./'):
         """
         Save the data regarding the canvas: Number of pieces of each case and price.
+
+        Parameters
+        ----------
+        output_dir: str
+            Directory where summary.json and the outputs of the canvas (see render.OUTPUT_FORMATS) are written
         """
-        with open('summary.json', 'w') as outfile:
-            json.dump(self.pieces_counter, outfile, indent=4)
+        summary_path = os.path.join(output_dir, 'summary.json')
+        mosaic_path = os.path.join(output_dir, 'mosaic.png')
+        with open(summary_path, 'w') as outfile:
+            json.dump(self.getSummary(), outfile, indent=4)
         
-        total_price = 0
-        for piece_key in self.pieces_counter.keys():
-            for color in self.valid_pieces[piece_key]:
-                num_of_pieces = self.pieces_counter[piece_key][color]
-                piece_price = self.valid_pieces[piece_key][color]
-                subtotal = num_of_pieces * piece_price
-                total_price +=  subtotal
+        total_price = self.getTotalPrice()
         print('INFO: The total price for the mosaic is: ' + str(np.round(total_price)) + ' DKK')
+        if self.fill_mode != 'greedy':
+            print('INFO: The ' + self.fill_mode + ' fill saves ' + str(np.round(self.fill_savings['price'])) + ' DKK and ' 
+                  + str(self.fill_savings['pieces']) + ' pieces with respect to the greedy fill')
+        if self.stock is not None and (self.anch_state == 0).any():
+            print('WARNING: ' + str(int((self.anch_state == 0).sum())) + ' anchors couldn\'t be covered with the available stock')
 
-        result= cv2.imwrite(r'./mosaic.png', self.img)
-        if result==True:
-            print('INFO: File saved successfully at: ' + './mosaic.png')
-        else:
-            print('ERROR: Couldn\'t save canvas image')
+        # The image is rendered and written in strips, so it never needs to be in memory as a whole. If the canvas
+        # was loaded from a previous state, only the strips that changed are rendered again.
+        if 'png' in self.output_formats:
+            try:
+                if self.dirty is None:
+                    self.writePng(mosaic_path)
+                else:
+                    updatePlacementsPng(mosaic_path, self.getPlacements(), self.size, self.piece_size, self.color_table, 
+                                        self.dirty.any(axis=0), owner=self.owner)
+                self.dirty = np.zeros(self.size, dtype=bool)
+                print('INFO: File saved successfully at: ' + mosaic_path)
+            except (IOError, ValueError) as e:
+                print('ERROR: Couldn\'t save canvas image: ' + str(e))
+
+        # The other formats are written from the placements in a single pass, their size and time grow with the
+        # number of pieces instead of the number of pixels
+        try:
+            if 'svg' in self.output_formats:
+                writePlacementsSvg(os.path.join(output_dir, 'mosaic.svg'), self.getPlacements(), self.size, 
+                                   self.piece_size, self.color_table)
+            if 'table' in self.output_formats:
+                writePlacementsTable(os.path.join(output_dir, 'placements.npy'), self.getPlacements())
+            if 'instructions' in self.output_formats:
+                plates = writeInstructions(os.path.join(output_dir, 'instructions'), self.getPlacements(), self.size, 
+                                           self.piece_size, self.color_table, self.color_names, self.plate_size)
+                print('INFO: Instructions saved for ' + str(plates) + ' baseplates')
+        except (IOError, ValueError) as e:
+            print('ERROR: Couldn\'t save canvas outputs: ' + str(e))
+
+    def getConfigKey(self):
+        """
+        Get a key that identifies the configuration of the canvas, a saved state can only be loaded by a canvas 
+        with the same configuration.
+        """
+        config = {'size': list(self.size), 'valid_pieces': self.valid_pieces, 'fill_mode': self.fill_mode, 
+                  'merge_design_blocks': self.merge_design_blocks, 'palette': self.getPaletteKey(),
+                  'stock': None if self.stock is None else (self.stock + self.counts).tolist()}
+        return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+    def saveState(self, path, designs=None):
+        """
+        Save the pieces of the canvas, so it can be updated in a later run (see loadState).
+
+        Parameters
+        ----------
+        path: str
+            Path of the .npz file
+        designs: dict
+            Data of the designs added to the canvas (e.g. their cache key and position), saved as JSON
+        """
+        state = {'config_key': self.getConfigKey(), 'placements': self.getPlacements(), 'counts': self.counts,
+                 'designs': json.dumps(designs or {})}
+        if self.stock is not None:
+            state['stock'] = self.stock
+        # Write to a temporary file first, so a broken run never leaves a partial state
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, **state)
+        os.replace(tmp_path, path)
+
+    def loadState(self, path):
+        """
+        Load the pieces saved by saveState. The anchors aren't marked as changed, so saving the canvas only 
+        renders again the regions modified after loading.
+
+        Parameters
+        ----------
+        path: str
+            Path of the .npz file
+
+        Returns
+        ----------
+        dict
+            Data of the designs saved with the state, None if the state can't be loaded (it doesn't exist or it 
+            was saved with a different configuration)
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as state:
+            if str(state['config_key']) != self.getConfigKey():
+                return None
+            # The anchors state and the owners are rebuilt from the placements
+            self.num_placements = 0
+            self.anch_state[...] = 0
+            self.owner[...] = -1
+            self.dirty = None
+            self.addPlacements(state['placements'])
+            self.counts[...] = state['counts']
+            if self.stock is not None:
+                self.stock[...] = state['stock']
+            designs = json.loads(str(state['designs']))
+        self.dirty = np.zeros(self.size, dtype=bool)
+        return designs
                         
     def visualize(self):
         """
         Visualize the current state of the canvas
         """
+        if self.headless:
+            return
         cv2.namedWindow('Canvas',cv2.WINDOW_NORMAL)
-        cv2.imshow("Canvas", self.img)
+        cv2.imshow("Canvas", self.render())
         cv2.waitKey(0)           
 
-    def parseDesign(self, image, size):
+    def parseDesign(self, image, size, sampling='center', draw_anchors=None):
         """
         Given and image with a pixel art design and its size (number of blocks per row and column).
         Parse the design in order to convert it to bricks.
@@ -251,40 +919,36 @@ class canvas(object):
         ----------
         image: numpy.ndarray
             image with the design
-        design: numpy.ndarray
-            Matrix with the colors for each block of the design
+        size: tuple
+            Number of blocks per row and column of the design
+        sampling: str
+            How the color of each block is extracted (see sampleDesign): 'center', 'mean' or 'median'
+        draw_anchors: bool
+            Draw the anchor points on top of the image and show it. By default, only when the canvas isn't headless.
 
         Returns
         ----------
         design: numpy.ndarray
             Matrix with the colors for each block of the design
         """
-        # Once the design has been selected, we need to select a number of anchor points used for extracting the color of each block
-        [height, width, _] = image.shape
-        # Get the position increments between each anchor point
-        inc_x = width/size[0]
-        inc_y = height/size[1]
-        # Define the x and y positions of the anchor points 
-        anch_x = np.arange(inc_x/2, width, inc_x)
-        anch_y = np.arange(inc_y/2, height, inc_y)
-
-        # Initialize container to save the design 
-        design = np.zeros(shape=(size[0], size[1], 3))
-        clone = image.copy()
-
-        # Go through all the anchor points and get the color of the pixel at its position. 
-        # For visualization, add a circle on top.
-        for _x in range(size[0]):
-            for _y in range(size[1]):
-                design[_x, _y] = np.asarray(clone[int(anch_y[_y]), int(anch_x[_x]), :])
-                cv2.circle(image, (int(anch_x[_x]),int(anch_y[_y])), 1, (0,0,255), -1) 
+        if draw_anchors is None:
+            draw_anchors = not self.headless
+
+        design = sampleDesign(image, size, sampling)
+
         # Visualize the original image with the anchor points on top. Each anchor should align with the center of the block.
-        cv2.namedWindow('Design and anchor points',cv2.WINDOW_NORMAL)
-        cv2.imshow('Design and anchor points', image)
+        if draw_anchors:
+            anch_x, anch_y = getDesignAnchors(image.shape, size)
+            for _x in anch_x:
+                for _y in anch_y:
+                    cv2.circle(image, (int(_x), int(_y)), 1, (0,0,255), -1) 
+            if not self.headless:
+                cv2.namedWindow('Design and anchor points',cv2.WINDOW_NORMAL)
+                cv2.imshow('Design and anchor points', image)
         
         return design
 
-    def addDesign(self, pos, design, keep_white):
+    def addDesign(self, pos, design, keep_white, dithering='none'):
         """
         Add a pixel art design to the canvas
                 
@@ -296,27 +960,135 @@ class canvas(object):
             Matrix with the colors for each block of the design
         keep_white: bool
             Define if the white bricks count as part of the design or only the background.
+        dithering: str
+            One of color_matching.DITHERING_MODES, use 'floyd-steinberg' or 'bayer' for photos
         """
-        # Get the size of the design
-        size = design.shape
+        color_idx, used = self.quantizeDesign(design, keep_white, dithering)
+        self.addQuantizedDesign(pos, color_idx, used)
 
-        # Loop through all the blocks of the design
-        for _x in range(size[0]):
-                for _y in range(size[1]):
-                    piece_color = np.asarray(design[_x, _y])
-                    piece_color = (int(piece_color[2]), int(piece_color[1]), int(piece_color[0]))                      
-                    if keep_white is False and self.isWhite(piece_color):
-                        continue
-                    else:
-                        piece_key = '1x1'
-                        piece_color, color_key = self.getClosestColor(piece_key, piece_color)
-                        piece_color = (int(piece_color[2]), int(piece_color[1]), int(piece_color[0]))   
-                        self.addPieceToCanvas((pos[0]+_x, pos[1]+_y), (1,1), piece_color)
-                        # Update the state of the anchors used by the design 
-                        self.anch_state[pos[0]+_x, pos[1]+_y] = 1
-                        self.incrementCounter(piece_key, color_key)
+    def quantizeDesign(self, design, keep_white, dithering='none'):
+        """
+        Get the closest Lego color for all the blocks of a design at once.
+                
+        Parameters
+        ----------
+        design: numpy.ndarray
+            Matrix with the colors (BGR) for each block of the design
+        keep_white: bool
+            Define if the white bricks count as part of the design or only the background.
+        dithering: str
+            One of color_matching.DITHERING_MODES
+
+        Returns
+        ----------
+        color_idx: numpy.ndarray
+            Index in colors_dictionary of the color of each block
+        used: numpy.ndarray
+            Boolean matrix, True for the blocks that are part of the design
+        """
+        return quantizeDesign(design, self.getLookupTable('1x1'), keep_white, dithering, self.color_table)
+
+    def addQuantizedDesign(self, pos, color_idx, used):
+        """
+        Add a design that has already been quantized (see quantizeDesign) to the canvas.
+                
+        Parameters
+        ----------
+        pos: tuple
+            Position of the top-left corner of the design
+        color_idx: numpy.ndarray
+            Index in colors_dictionary of the color of each block
+        used: numpy.ndarray
+            Boolean matrix, True for the blocks that are part of the design
+        """
+        if self.stock is not None:
+            # Colors that aren't in stock are substituted by the closest ones left. With merged blocks any piece type 
+            # can be used, so the capacity of a color is the number of anchors that its pieces can cover.
+            if self.merge_design_blocks:
+                areas = np.asarray([np.prod(getPieceSize(e)) for e in self.piece_keys])
+                capacity = areas @ self.stock
+            else:
+                capacity = self.stock[self.piece_index['1x1']]
+            color_idx, used = self.constrainColors(color_idx, used, capacity)
+
+        if not self.merge_design_blocks:
+            # Add all the blocks of the design to the canvas at once
+            xs, ys = np.nonzero(used)
+            self.placePieces('1x1', xs + pos[0], ys + pos[1], color_idx[xs, ys])
+        else:
+            # The blocks of each color are covered with the biggest pieces available in that color, all the regions 
+            # of the same color at once. The colors come from the 1x1 palette, so 1x1 pieces are always available.
+            for color in np.unique(color_idx[used]):
+                mask = used & (color_idx == color)
+                # Only the bounding box of the color is tiled
+                cols, rows = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+                x0, y0 = cols[0], rows[0]
+                mask = mask[x0:cols[-1]+1, y0:rows[-1]+1]
+                keys = [key for key in PIECE_KEYS if key in self.valid_pieces and self.color_names[color] in self.valid_pieces[key]]
+                if self.stock is not None:
+                    limits = {key: self.stock[self.piece_index[key], color] for key in keys}
+                    placements = tileMask(mask, keys, limits)
+                elif self.fill_mode == 'greedy':
+                    placements = tileMask(mask, keys)
+                else:
+                    # The regions of a color are usually fragmented, tileMaskOptimal keeps the greedy tiling when
+                    # it is cheaper
+                    placements = tileMaskOptimal(mask, self.getPieceCosts(keys, color))
+                for key, xs, ys in placements:
+                    self.placePieces(key, xs + pos[0] + x0, ys + pos[1] + y0, np.full(len(xs), color))
+            if self.stock is not None:
+                # The pieces left of a color may not fit in its regions (e.g. only 2x4 pieces for thin lines), these
+                # blocks are covered with the 1x1 pieces left of the closest colors
+                section = (slice(pos[0], pos[0]+used.shape[0]), slice(pos[1], pos[1]+used.shape[1]))
+                left = used & (self.anch_state[section] == 0)
+                if left.any():
+                    color_idx, left = self.constrainColors(color_idx, left, self.stock[self.piece_index['1x1']])
+                    xs, ys = np.nonzero(left)
+                    self.placePieces('1x1', xs + pos[0], ys + pos[1], color_idx[xs, ys])
         # In case that the white blocks are not considered, there may be empty spots. That's why we fill the design space.
-        self.fillSection(pos, size)
+        self.fillSection(pos, used.shape)
+
+    def constrainColors(self, color_idx, used, capacity):
+        """
+        Substitute the colors of a quantized design so that the number of blocks of each color doesn't exceed its 
+        capacity. The blocks are moved to the closest colors minimizing the total error of all the substitutions
+        (see color_matching.assignWithCapacity). Which blocks of a color are substituted is chosen at random, so 
+        the substitutions are spread over the design.
+
+        Parameters
+        ----------
+        color_idx: numpy.ndarray
+            Index in colors_dictionary of the color of each block
+        used: numpy.ndarray
+            Boolean matrix, True for the blocks that are part of the design
+        capacity: numpy.ndarray
+            Maximum number of blocks of each color of colors_dictionary
+
+        Returns
+        ----------
+        color_idx: numpy.ndarray
+            Index in colors_dictionary of the new color of each block
+        used: numpy.ndarray
+            Boolean matrix, False for the blocks that couldn't get any color
+        """
+        # The design colors come from the 1x1 palette, the substitutes are taken from the same palette
+        palette_idx = self.palette_idx['1x1']
+        position = np.full(len(self.color_names), -1)
+        position[palette_idx] = np.arange(len(palette_idx))
+        xs, ys = np.nonzero(used)
+        groups, inverse = np.unique(position[color_idx[xs, ys]], return_inverse=True)
+        palette = self.matching_palettes['1x1']
+        distances = getColorDistances(palette[groups], palette, self.color_metric)
+        assigned = assignWithCapacity(np.bincount(inverse), np.asarray(capacity)[palette_idx], distances)
+
+        color_idx = color_idx.copy()
+        used = used.copy()
+        for g in range(len(groups)):
+            blocks = np.random.permutation(np.nonzero(inverse == g)[0])
+            colors = np.repeat(palette_idx, assigned[g])
+            color_idx[xs[blocks[:len(colors)]], ys[blocks[:len(colors)]]] = colors
+            used[xs[blocks[len(colors):]], ys[blocks[len(colors):]]] = False
+        return color_idx, used
 
     def getClosestColor(self, piece_key, color):
         """
@@ -337,47 +1109,107 @@ class canvas(object):
         color_match_key: str
             Lego color value
         """ 
-        d_min = np.iinfo(np.uint64).max
-        color_match = None
-        color_match_key = None
-        for color_key in self.pieces_counter[piece_key].keys():
-            color_db = colors_dictionary[color_key]
-            d =   np.sqrt(((color[0]-color_db[0]))**2  + ((color[1]-color_db[1]))**2 + ((color[2]-color_db[2]))**2)
-            if d < d_min:
-                d_min = d
-                color_match = color_db
-                color_match_key = color_key
-        return color_match, color_match_key
-
-    def isWhite(self, color):
-        """
-        Check if a color is white.
+        color_idx, color_keys = self.getClosestColors(piece_key, np.asarray(color))
+        color_match = colors_dictionary[str(color_keys)]
+        return color_match, str(color_keys)
+
+    def getClosestColors(self, piece_key, colors):
+        """
+        Vectorized version of getClosestColor: get the closest Lego color for a whole array of RGB values
+        with a single lookup in the table of the piece type.
                 
         Parameters
         ----------
-        color: tuple
-            Color to be checked.
+        piece_key: str
+            Piece type
+        colors: numpy.ndarray
+            Array of RGB values with shape (..., 3), e.g. a design matrix
+
+        Returns
+        ----------
+        color_idx: numpy.ndarray
+            Index of the closest color in colors_dictionary (see self.color_names), with shape (...)
+        color_keys: numpy.ndarray
+            Lego color value of the closest color, with shape (...)
+        """
+        color_idx = applyLookupTable(self.getLookupTable(piece_key), colors)
+        return color_idx, self.color_names[color_idx]
+
+    def getLookupTable(self, piece_key):
+        """
+        Get the table that maps every RGB value to the index of the closest color for a piece type, using the 
+        color metric of the canvas. The tables are cached on disk, so they are only built once for each palette.
+                
+        Parameters
+        ----------
+        piece_key: str
+            Piece type
+
+        Returns
+        ----------
+        numpy.ndarray
+            Lookup table with shape (2**lut_bits, 2**lut_bits, 2**lut_bits)
+        """
+        if piece_key not in self.luts:
+            self.luts[piece_key] = loadLookupTable(self.matching_palettes[piece_key], self.palette_idx[piece_key], self.lut_bits, 
+                                                   self.color_metric, self.cache_dir)
+        return self.luts[piece_key]
+
+    def getPaletteKey(self):
+        """
+        Get a key that identifies how the designs are quantized: the palette of the 1x1 pieces, the precision
+        of the lookup table and the color metric.
+        """
+        return paletteHash(self.matching_palettes['1x1'], self.palette_idx['1x1'], self.lut_bits, self.color_metric)
+
+    def loadCachedDesign(self, key):
+        """
+        Get a quantized design from the cache.
+
+        Parameters
+        ----------
+        key: str
+            Key of the design, see getDesignKey()
 
         Returns
         ----------
-        bool
-            True if color is white, False otherwise
+        tuple
+            (color_idx, used) as returned by quantizeDesign, None if the design isn't cached
+        """
+        if self.cache_dir is None:
+            return None
+        path = os.path.join(self.cache_dir, 'design_' + key + '.npz')
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return data['color_idx'], data['used']
+
+    def cacheDesign(self, key, color_idx, used):
+        """
+        Save a quantized design in the cache, see loadCachedDesign().
         """
-        for c in color:
-            if c < 250:
-                return False
-        return True
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, 'design_' + key + '.npz')
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp.npz'
+        np.savez(tmp_path, color_idx=color_idx, used=used)
+        os.replace(tmp_path, path)
 
     def visualizeAnchorsState(self):
         """
         Visualize the state of the anchors, blue if used, green if not.        
         """
-        temp = self.clone.copy()
+        if self.headless:
+            return
+        # Empty canvas as background
+        temp = renderPlacements(np.zeros((0, 5), dtype=np.int32), self.size, self.piece_size, self.color_table)
 
+        anch_pos = self.anch_pos
         for _x in range(self.size[0]):
             for _y in range(self.size[1]):
 
-                pos = (int(self.anch_pos[_x, _y][0]), int(self.anch_pos[_x, _y][1]))
+                pos = (int(anch_pos[_x, _y][0]), int(anch_pos[_x, _y][1]))
                 if self.anch_state[_x, _y] == 0:
                     color = (255,0,0)
                 else:
@@ -392,8 +1224,10 @@ class canvas(object):
         """
         Visualize the available colors for each available piece.              
         """
+        if self.headless:
+            return
 
-        valid_bricks = self.pieces_counter.keys()
+        valid_bricks = self.valid_pieces.keys()
         valid_colors = colors_dictionary.keys()
 
         # Define the position of the anchor points for each rectangle (one per possible color)
@@ -429,7 +1263,7 @@ class canvas(object):
             cv2.putText(img, piece_key, text_pos, cv2.FONT_HERSHEY_SIMPLEX,1, (0, 0, 0, 0), 2) 
 
             for color_key in valid_colors:
-                if color_key in self.pieces_counter[piece_key].keys(): 
+                if color_key in self.valid_pieces[piece_key]: 
                     color = colors_dictionary[color_key]
                     color = (color[2], color[1], color[0])
                     